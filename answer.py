@@ -1,3 +1,4 @@
+import hashlib
 import math
 import socket, ssl, sys
 import ctypes
@@ -7,6 +8,8 @@ import skia
 import threading
 import time
 import wbetools
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 import OpenGL.GL
 
 import urllib.parse
@@ -15,6 +18,8 @@ EVENT_DISPATCH_JS = "new Node(dukpy.handle).dispatchEvent(new Event(dukpy.type))
 
 REFRESH_RATE_SEC = .033
 
+SUBRESOURCE_FETCH_THREADS = 8
+
 BLOCK_ELEMENTS = [
     "html", "body", "article", "section", "nav", "aside",
     "h1", "h2", "h3", "h4", "h5", "h6", "hgroup", "header",
@@ -26,6 +31,11 @@ BLOCK_ELEMENTS = [
 
 COOKIE_JAR = {}
 
+# GETs currently on the network, keyed by (scheme, host, port, request
+# text), so identical concurrent fetches share one round trip.
+IN_FLIGHT_REQUESTS = {}
+IN_FLIGHT_LOCK = threading.Lock()
+
 class MeasureTime:
     def __init__(self):
         if not wbetools.OUTPUT_TRACE: return
@@ -470,6 +480,25 @@ class DescendantSelector:
     
 DEFAULT_STYLE_SHEET = CSSParser(open("answer.css").read()).parse()
 
+# Parsed rule lists keyed by (stylesheet URL, validator), so reloads and
+# back/forward navigation don't re-run CSSParser on unchanged sheets.
+STYLESHEET_CACHE_SIZE = 64
+STYLESHEET_CACHE = OrderedDict()
+
+def parse_stylesheet(url, headers, body):
+    validator = headers.get("etag") or headers.get("last-modified")
+    if not validator:
+        validator = hashlib.sha1(body.encode("utf8", "surrogatepass")).hexdigest()
+    key = (str(url), validator)
+    if key in STYLESHEET_CACHE:
+        STYLESHEET_CACHE.move_to_end(key)
+        return STYLESHEET_CACHE[key]
+    rules = CSSParser(body).parse()
+    STYLESHEET_CACHE[key] = rules
+    while len(STYLESHEET_CACHE) > STYLESHEET_CACHE_SIZE:
+        STYLESHEET_CACHE.popitem(last=False)
+    return rules
+
 INHERITED_PROPERTIES = {
     "font-size": "16px",
     "font-style": "normal",
@@ -1212,12 +1241,6 @@ class URL:
             self.port = int(p)
 
     def request(self, referrer, payload = None):
-        s = socket.socket()
-        s.connect((self.host, self.port))
-        if self.scheme == "https":
-            s = ssl.create_default_context().wrap_socket(
-                s, server_hostname=self.host)
-            
         method = "POST" if payload else "GET"
         request = "{} {} HTTP/1.0\r\n".format(method, self.path)
         request += "Host: {}\r\n".format(self.host)
@@ -1237,6 +1260,36 @@ class URL:
         request += "\r\n"
         if payload: request += payload
 
+        if method != "GET":
+            return self.send(request)
+
+        key = (self.scheme, self.host, self.port, request)
+        with IN_FLIGHT_LOCK:
+            future = IN_FLIGHT_REQUESTS.get(key)
+            leader = future is None
+            if leader:
+                future = IN_FLIGHT_REQUESTS[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            result = self.send(request)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with IN_FLIGHT_LOCK:
+                del IN_FLIGHT_REQUESTS[key]
+
+    def send(self, request):
+        s = socket.socket()
+        s.connect((self.host, self.port))
+        if self.scheme == "https":
+            s = ssl.create_default_context().wrap_socket(
+                s, server_hostname=self.host)
+
         s.send(request.encode("utf8"))
         response = s.makefile("r", encoding="utf8", newline="\r\n")
     
@@ -1858,29 +1911,49 @@ class Tab:
                 and node.attributes.get("rel") == "stylesheet"
                 and "href" in node.attributes]
 
-        for link in links:
-            try:
-                headers, body = url.resolve(link).request(url)
-            except:
-                continue
-            self.rules.extend(CSSParser(body).parse())
-        
-        if self.js: self.js.discarded = True
-        self.js = JSContext(self)
         scripts = [node.attributes["src"]
                    for node in tree_to_list(self.nodes, [])
                    if isinstance(node, Element) and node.tag == "script" and "src" in node.attributes]
+        script_urls = []
         for script in scripts:
             script_url = url.resolve(script)
             if not self.allowed_request(script_url):
                 print("Blocked script", script, "due to CSP")
                 continue
+            script_urls.append(script_url)
+
+        def fetch_stylesheet(link):
+            try:
+                style_url = url.resolve(link)
+                headers, body = style_url.request(url)
+            except:
+                return None
+            return style_url, headers, body
+
+        def fetch_script(script_url):
             try:
                 header, body = script_url.request(url)
             except:
-                continue
-            task = Task(self.js.run, script_url, body)
-            self.task_runner.schedule_task(task)
+                return None
+            return body
+
+        # Fetch every stylesheet and script at once; results are
+        # still applied in document order.
+        with ThreadPoolExecutor(
+            max_workers=SUBRESOURCE_FETCH_THREADS) as pool:
+            stylesheets = pool.map(fetch_stylesheet, links)
+            script_bodies = pool.map(fetch_script, script_urls)
+
+            for stylesheet in stylesheets:
+                if stylesheet is None: continue
+                self.rules.extend(parse_stylesheet(*stylesheet))
+
+            if self.js: self.js.discarded = True
+            self.js = JSContext(self)
+            for script_url, body in zip(script_urls, script_bodies):
+                if body is None: continue
+                task = Task(self.js.run, script_url, body)
+                self.task_runner.schedule_task(task)
         self.set_needs_render()
         self.loaded = True
 
@@ -0,0 +1,407 @@
+import gc
+import shlex
+import socket
+import sys
+import threading
+import time
+import tkinter
+import tkinter.font as tkfont
+import tracemalloc
+
+import cache
+import server
+from documentLayout import DocumentLayout
+from htmlParser import HTMLParser, TAG
+from domArena import ArenaParser
+from element import Element
+from text import Text
+from response import ResponseParser, ResponseReader
+
+PARAGRAPH = (
+  "<div class=\"item\"><p>Lorem ipsum <b>dolor</b> sit amet, "
+  "<i>consectetur</i> adipiscing elit.</p>\n"
+  "<p>Sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.</p></div>\n"
+)
+
+def make_page(size_bytes):
+  count = size_bytes // len(PARAGRAPH) + 1
+  return "<!doctype html><html><body>\n" + PARAGRAPH * count + "</body></html>"
+
+def timed(fn, *args):
+  start = time.perf_counter()
+  result = fn(*args)
+  return time.perf_counter() - start, result
+
+def bench_parse(sizes_mb=(1, 2, 4, 8)):
+  print("HTMLParser.tokenize / HTMLParser.parse")
+  for mb in sizes_mb:
+    page = make_page(mb * 1024 * 1024)
+    tokenize, _ = timed(lambda: sum(1 for _ in HTMLParser(page).tokenize(page)))
+    parse, _ = timed(lambda: HTMLParser(page).parse())
+    print(f"  {mb:>3} MB  tokenize {tokenize:7.3f} s ({tokenize / mb:.3f} s/MB)"
+          f"  parse {parse:7.3f} s ({parse / mb:.3f} s/MB)")
+
+def shlex_get_attributes(text):
+  # 바꾸기 전의 HTMLParser.get_attributes 를 그대로 옮겨 둔 것 (비교용)
+  parts = shlex.split(text) if text and text.strip() else []
+  if not parts:
+    return "", {}
+
+  tag = parts[0].casefold()
+
+  attributes = {}
+  for attrpair in parts[1:]:
+    if "=" in attrpair:
+      key, value = attrpair.split("=", 1)
+      attributes[key.casefold()] = value
+    else:
+      attributes[attrpair.casefold()] = True
+
+  return tag, attributes
+
+def make_tag_page(count):
+  tag = "<a href=\"/page?id={0}\" class=link data-id='{0}' hidden>{0}</a>"
+  return "".join(tag.format(i) for i in range(count // 2))
+
+def bench_attributes():
+  print("HTMLParser.get_attributes (shlex vs tag lexer)")
+  pages = {
+    "server.show_count": server.show_count(),
+    "100k tags": make_tag_page(100_000),
+  }
+  for name, page in pages.items():
+    parser = HTMLParser()
+    tags = [value for kind, value in parser.tokenize(page) if kind == TAG]
+    old, _ = timed(lambda: [shlex_get_attributes(t) for t in tags])
+    new, _ = timed(lambda: [parser.get_attributes(t) for t in tags])
+    print(f"  {name:<18} {len(tags):>7} tags  shlex {old:7.3f} s  lexer {new:7.3f} s  x{old / new:.1f}")
+
+def make_deep_page(depth):
+  return "<div><span>x</span>" * depth + "</div>" * depth
+
+def bench_deep(depths=(2_000, 4_000, 8_000, 16_000)):
+  print("HTMLParser.parse on deeply nested pages")
+  for depth in depths:
+    page = make_deep_page(depth)
+    elapsed, _ = timed(lambda: HTMLParser(page).parse())
+    print(f"  depth {depth:>6}  {elapsed:7.3f} s  {elapsed / depth * 1e6:6.1f} us/level")
+
+def iter_nodes(node):
+  stack = [node]
+  while stack:
+    node = stack.pop()
+    yield node
+    stack.extend(reversed(node.children))
+
+def count_nodes(node):
+  count = 0
+  stack = [node]
+  while stack:
+    node = stack.pop()
+    count += 1
+    stack.extend(node.children)
+  return count
+
+class DictElement:
+  # __slots__ 를 쓰기 전의 Element (비교용). 노드마다 __dict__ 와 빈 children list 가 생긴다.
+  # append_child 만 지금 파서가 부르므로 더했다.
+  def __init__(self, tag, attributes, parent):
+    self.tag = tag
+    self.attributes = attributes
+    self.children = []
+    self.parent = parent
+
+  def append_child(self, node):
+    self.children.append(node)
+
+class DictText:
+  # __slots__ 를 쓰기 전의 Text (비교용)
+  def __init__(self, text, parent):
+    self.text = text
+    self.children = []
+    self.parent = parent
+
+class DictNodeParser(HTMLParser):
+  # 지금 파서로 파싱하되 노드는 __slots__ 이전의 클래스로 만든다.
+  new_element = DictElement
+  new_text = DictText
+
+def bench_memory(mb=4):
+  print("DOM memory (steady state per node / peak while building)")
+  page = make_page(mb * 1024 * 1024)
+  for label, parser in (("dict nodes", DictNodeParser), ("__slots__", HTMLParser)):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    root = parser(page).parse()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    nodes = count_nodes(root)
+    if parser is DictNodeParser:
+      print(f"  {mb} MB page  {nodes} nodes")
+    print(f"    {label:<12}  {(after - before) / nodes:6.1f} bytes/node  peak {(peak - before) / 1024 / 1024:7.1f} MB")
+    del root
+
+  # ArenaParser 는 객체 트리를 거치지 않고 arena 에 바로 쓴다.
+  gc.collect()
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  parser = ArenaParser(page)
+  parser.parse()
+  arena = parser.arena
+  del parser
+  after, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  print(f"    {'DOMArena':<12}  {(after - before) / len(arena):6.1f} bytes/node  peak {(peak - before) / 1024 / 1024:7.1f} MB")
+
+def serve_once(body, chunk_size=16 * 1024):
+  # 한 번만 응답하는 로컬 서버. chunked 로 body 를 보내고 (host, port) 를 돌려준다.
+  listener = socket.socket()
+  listener.bind(("127.0.0.1", 0))
+  listener.listen(1)
+
+  # 보내는 쪽이 받는 동안 메모리를 잡지 않도록 청크는 미리 만들어 둔다.
+  frames = [b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"]
+  for i in range(0, len(body), chunk_size):
+    chunk = body[i:i + chunk_size]
+    frames.append(b"%x\r\n" % len(chunk) + chunk + b"\r\n")
+  frames.append(b"0\r\n\r\n")
+
+  def run():
+    conn, _ = listener.accept()
+    conn.recv(4096)
+    for frame in frames:
+      conn.sendall(frame)
+    conn.close()
+    listener.close()
+
+  threading.Thread(target=run, daemon=True).start()
+  return listener.getsockname()
+
+def receive_read1(sock, parser):
+  # recv_into 로 바꾸기 전의 makefile().read1 루프 (비교용). 받을 때마다 새 bytes 가 생긴다.
+  response = sock.makefile("rb")
+  while not parser.done:
+    data = response.read1(64 * 1024)
+    if not data:
+      parser.feed_eof()
+      break
+    pos = 0
+    while pos < len(data) and not parser.done:
+      pos = parser.feed(data, pos)
+  response.close()
+
+def receive_into(sock, parser):
+  reader = ResponseReader(sock)
+  reader.read_head(parser)
+  reader.read_body(parser)
+  reader.close()
+
+def receive_once(receive, body, traced):
+  received = [0]
+  parser = ResponseParser(on_body=lambda chunk: received.__setitem__(0, received[0] + len(chunk)))
+  sock = socket.create_connection(serve_once(body))
+  sock.sendall(b"GET / HTTP/1.1\r\n\r\n")
+  if traced:
+    tracemalloc.start()
+  elapsed, _ = timed(receive, sock, parser)
+  peak = tracemalloc.get_traced_memory()[1] if traced else 0
+  if traced:
+    tracemalloc.stop()
+  sock.close()
+  assert received[0] == len(body)
+  return elapsed, peak
+
+def bench_receive(mb=32):
+  print("Response receive (makefile().read1 vs recv_into)")
+  body = b"x" * (mb * 1024 * 1024)
+  for name, receive in (("read1", receive_read1), ("recv_into", receive_into)):
+    # 시간은 tracemalloc 없이 재고, 받는 동안 새로 잡은 메모리의 최대치는 따로 한 번 더 받아서 잰다.
+    elapsed, _ = receive_once(receive, body, traced=False)
+    _, peak = receive_once(receive, body, traced=True)
+    print(f"  {name:<10} {mb} MB  {elapsed:7.3f} s ({mb / elapsed:7.1f} MB/s)"
+          f"  peak allocated while receiving {peak / 1024:8.1f} KB")
+
+def count_words(node):
+  words = 0
+  stack = [node]
+  while stack:
+    node = stack.pop()
+    if hasattr(node, "text"):
+      words += len(node.text.split())
+    stack.extend(node.children)
+  return words
+
+def with_tk_fonts(bench):
+  # Tk 글꼴은 화면이 있어야 만들 수 있다. measure / metrics 호출 수를 세어 bench(calls) 에 넘긴다.
+  try:
+    root = tkinter.Tk()
+  except tkinter.TclError:
+    print("  skipped: Tk fonts need a display")
+    return
+  root.withdraw()
+
+  calls = {"measure": 0, "metrics": 0}
+  originals = {name: getattr(tkfont.Font, name) for name in calls}
+  def counting(name):
+    def wrapper(self, *args, **kwargs):
+      calls[name] += 1
+      return originals[name](self, *args, **kwargs)
+    return wrapper
+  for name in calls:
+    setattr(tkfont.Font, name, counting(name))
+
+  try:
+    bench(calls)
+  finally:
+    for name, original in originals.items():
+      setattr(tkfont.Font, name, original)
+    root.destroy()
+
+class UncachedFont(tkfont.Font):
+  # 글꼴 캐시가 없을 때처럼 폭과 metrics 를 쓸 때마다 Tk 에 묻는 글꼴 (비교용)
+  @property
+  def ascent(self):
+    return self.metrics("ascent")
+
+  @property
+  def descent(self):
+    return self.metrics("descent")
+
+  @property
+  def linespace(self):
+    return self.metrics("linespace")
+
+  @property
+  def space_width(self):
+    return self.measure(" ")
+
+  def advances(self, text):
+    return [self.measure(ch) for ch in text]
+
+def bench_measure(mb=1):
+  print("DocumentLayout.layout Tk font calls (uncached fonts vs cold / warm font cache)")
+
+  def run(calls):
+    node = HTMLParser(make_page(mb * 1024 * 1024)).parse()
+    print(f"  {mb} MB page  {count_words(node)} words")
+    cached_font = cache.CachedFont
+    for label in ("uncached", "cold", "warm"):
+      if label != "warm":
+        cache._FONTS.clear()
+      cache.CachedFont = UncachedFont if label == "uncached" else cached_font
+      calls.update(measure=0, metrics=0)
+      try:
+        elapsed, _ = timed(lambda: DocumentLayout(node, width=800, rtl=False).layout())
+      finally:
+        cache.CachedFont = cached_font
+      print(f"    {label:<8} {elapsed:7.3f} s  measure {calls['measure']:>7}  metrics {calls['metrics']:>7}")
+    cache._FONTS.clear()
+
+  with_tk_fonts(run)
+
+def count_draw_items(layout):
+  count = 0
+  stack = [layout]
+  while stack:
+    layout = stack.pop()
+    count += len(layout.paint())
+    stack.extend(layout.children)
+  return count
+
+def bench_pre(mb=1):
+  print("view-source layout (<pre> text laid out in runs)")
+
+  def run(calls):
+    source = make_page(mb * 1024 * 1024)
+    root = Element("pre", {}, None)
+    root.append_child(Text(source, root))
+    cache._FONTS.clear()
+    # 묶어서 배치하기 전에는 글자마다 measure 한 번과 DrawText 하나였다.
+    print(f"  {mb} MB source  {len(source)} chars  (per character: ~{len(source)} measure calls / draw items)")
+    for rtl in (False, True):
+      calls.update(measure=0, metrics=0)
+      document = DocumentLayout(root, width=800, rtl=rtl, bold=True)
+      elapsed, _ = timed(document.layout)
+      print(f"    rtl={rtl!s:<5} {elapsed:7.3f} s  measure {calls['measure']:>7}  metrics {calls['metrics']:>7}"
+            f"  draw items {count_draw_items(document):>7}")
+
+  with_tk_fonts(run)
+
+def bench_resize(mb=1, widths=(800, 1200, 800, 1200)):
+  print("DocumentLayout.resize (line breaks cached per width)")
+
+  def run(calls):
+    node = HTMLParser(make_page(mb * 1024 * 1024)).parse()
+    document = DocumentLayout(node, width=widths[0], rtl=False)
+    elapsed, _ = timed(document.layout)
+    print(f"  {mb} MB page  layout at {widths[0]:>5} px  {elapsed:7.3f} s")
+    # 처음 보는 폭은 줄바꿈만 다시 하고, 이미 본 폭은 캐시된 결과를 그대로 쓴다. (measure 는 0 이어야 한다)
+    for width in widths[1:]:
+      calls.update(measure=0, metrics=0)
+      elapsed, _ = timed(document.resize, width)
+      print(f"    resize {width:>5} px  {elapsed:7.3f} s  measure {calls['measure']:>7}  metrics {calls['metrics']:>7}")
+
+  with_tk_fonts(run)
+
+def bench_incremental(mb=1):
+  print("DocumentLayout.layout after one DOM edit (full vs incremental)")
+
+  def run(calls):
+    node = HTMLParser(make_page(mb * 1024 * 1024)).parse()
+    document = DocumentLayout(node, width=800, rtl=False)
+    elapsed, _ = timed(document.layout)
+    print(f"  {mb} MB page  full layout {elapsed:7.3f} s")
+    # 가운데 문단 하나만 바꾼다. 그 블록만 다시 배치하고 뒤의 형제들은 y 만 옮긴다.
+    texts = [n for n in iter_nodes(node) if isinstance(n, Text) and n.text.strip()]
+    for label, edit in (
+      ("set_text", lambda: texts[len(texts) // 2].set_text("changed " * 40)),
+      ("append", lambda: texts[len(texts) // 3].parent.append_child(Text(" appended", texts[len(texts) // 3].parent))),
+    ):
+      calls.update(measure=0, metrics=0)
+      elapsed, _ = timed(lambda: (edit(), document.layout()))
+      print(f"    {label:<9} {elapsed:7.3f} s  measure {calls['measure']:>7}  metrics {calls['metrics']:>7}")
+
+  with_tk_fonts(run)
+
+def bench_progressive(mb=1, viewport=600, step=6000):
+  print("DocumentLayout.layout(limit) (first screen vs whole page)")
+
+  def run(calls):
+    node = HTMLParser(make_page(mb * 1024 * 1024)).parse()
+    elapsed, _ = timed(DocumentLayout(node, width=800, rtl=False).layout)
+    print(f"  {mb} MB page  full layout {elapsed:7.3f} s")
+
+    node = HTMLParser(make_page(mb * 1024 * 1024)).parse()
+    document = DocumentLayout(node, width=800, rtl=False)
+    elapsed, _ = timed(document.layout, 2 * viewport)
+    estimate = document.content_height
+    print(f"    first screen {elapsed:7.3f} s  estimated height {estimate:>9.0f}")
+    # 나머지는 Browser 가 idle 때 하듯 step 씩 이어서 배치한다.
+    passes = 0
+    start = time.perf_counter()
+    while not document.complete:
+      document.layout(document.layout_bottom + step)
+      passes += 1
+    elapsed = time.perf_counter() - start
+    print(f"    rest         {elapsed:7.3f} s  in {passes} idle passes  actual height {document.content_height:>9.0f}")
+
+  with_tk_fonts(run)
+
+BENCHMARKS = {
+  "parse": bench_parse,
+  "attributes": bench_attributes,
+  "deep": bench_deep,
+  "memory": bench_memory,
+  "receive": bench_receive,
+  "measure": bench_measure,
+  "pre": bench_pre,
+  "resize": bench_resize,
+  "incremental": bench_incremental,
+  "progressive": bench_progressive,
+}
+
+if __name__ == "__main__":
+  names = sys.argv[1:] or list(BENCHMARKS)
+  for name in names:
+    BENCHMARKS[name]()
@@ -1,3 +1,8 @@
+import weakref
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from itertools import accumulate
+
 from text import Text
 from element import Element
 
@@ -19,6 +24,13 @@ HIDDEN_TAGS = ["head", "title", "meta", "link", "style", "script"]
 
 RUN_IN_TAG = "h6"
 
+# 인라인 블록의 내용을 폭과 상관없는 항목 목록으로 한 번 만들어 두고(collect_items),
+# 폭이 정해지면 그 목록만 다시 훑어서 줄을 나눈다(break_lines).
+#   (WORD, text, font, width) / (SPACE, width) / (PRE, text, font) / (NEWLINE,) / (LINE_BREAK,) / (SUP, on)
+WORD, SPACE, PRE, NEWLINE, LINE_BREAK, SUP = range(6)
+# 인라인 블록마다 최근 폭 몇 개의 줄바꿈 결과를 기억한다. (최대화/복원, 왔다 갔다 하는 드래그)
+LINE_BREAK_CACHE_SIZE = 4
+
 class BlockLayout:
   def __init__(self, nodes, parent, previous, rtl, bold: bool = False, tag_color: str = None, runin_prefix=None):
     self.nodes = nodes if isinstance(nodes, list) else [nodes]
@@ -57,9 +69,42 @@ class BlockLayout:
     self.is_pre = False
     self.font_family = None
 
+    self.items = None
+    # width -> (display_list, height)
+    self.line_breaks = OrderedDict()
+
+    # dirty: 이 블록이 맡은 노드가 바뀌어서 자식 블록/항목을 다시 만들어야 한다.
+    # child_dirty: 자손 중에 dirty 가 있다. 둘 다 아니고 폭도 같으면 layout 은 y 만 옮긴다.
+    # 노드는 자기를 배치한 블록을 약한 참조(handle)로 가리킨다. (DOM 이 레이아웃을 붙잡지 않게)
+    self.dirty = True
+    self.child_dirty = False
+    self.handle = weakref.ref(self)
+
+    # 배치를 마친 자식 블록 수와 그 안의 글자 수. (limit 로 중간에 멈추면 children 보다 적다)
+    self.laid_out = 0
+    self.chars = 0
+
+  def mark_dirty(self):
+    self.dirty = True
+    layout = self.parent
+    while isinstance(layout, BlockLayout) and not layout.child_dirty:
+      layout.child_dirty = True
+      layout = layout.parent
+
+  def shift(self, dy):
+    # display_list 는 블록 기준 좌표이므로 블록들의 y 만 옮기면 된다.
+    stack = [self]
+    while stack:
+      layout = stack.pop()
+      layout.y += dy
+      stack.extend(layout.children)
+
+  def reuse_key(self):
+    return (tuple(map(id, self.nodes)), tuple(map(id, self.runin_prefix)), self.bold)
+
   def open_tag(self, tag):
     if tag in BLOCK_TAGS and tag != RUN_IN_TAG:
-      self.flush()
+      self.items.append((LINE_BREAK,))
 
     if tag == "i":
       self.style = "italic"
@@ -70,16 +115,17 @@ class BlockLayout:
     elif tag == "big":
       self.size += 4
     elif tag == "br":
-      self.flush()
+      self.items.append((LINE_BREAK,))
     elif tag == "sup":
       self.size -= 4
       self.is_sup = True
+      self.items.append((SUP, True))
     elif tag == "abbr":
       self.abbr_size_stack.append(self.size)
       self.size -= 2
       self.is_abbr = True
     elif tag == "pre":
-      self.flush()
+      self.items.append((LINE_BREAK,))
       self.is_pre = True
       self.font_family = "SF Mono"
     elif tag == RUN_IN_TAG:
@@ -102,22 +148,25 @@ class BlockLayout:
         self.size, self.weight, self.style = self._h6_stack.pop()
       self._add_space()
     elif tag in BLOCK_TAGS:
-      self.flush()
+      self.items.append((LINE_BREAK,))
     elif tag == "sup":
       self.size += 4
       self.is_sup = False
+      self.items.append((SUP, False))
     elif tag == "abbr":
       if self.abbr_size_stack:
         self.size = self.abbr_size_stack.pop()
       self.is_abbr = False
     elif tag == "pre":
-      self.flush()
+      self.items.append((LINE_BREAK,))
       self.is_pre = False
       self.font_family = None
   
   def _add_space(self):
     font = get_font(self.size, self.weight, self.style) if not self.is_pre else get_font(self.size, self.weight, self.style, family="SF Mono")
-    space = font.measure(" ")
+    self.items.append((SPACE, font.space_width))
+
+  def place_space(self, space):
     if self.rtl:
       self.cursor_x -= space
       if self.cursor_x < 0:
@@ -128,7 +177,9 @@ class BlockLayout:
         self.flush()
 
   def recurse(self, tree):
+    tree.layout_object = self.handle
     if isinstance(tree, Text):
+      self.chars += len(tree.text)
       if self.is_pre:
         self.word(tree.text)
       else:
@@ -150,68 +201,18 @@ class BlockLayout:
 
     if self.is_pre:
       text = text.replace("\r\n", "\n").replace("\r", "\n")
-
-      inside_tag = False
-      in_tag_name = False
-      expect_tag_name = False
-
-      for ch in text:
-        if ch == "\n":
-          self.flush()
-          self.cursor_x = (self.width - HSTEP) if self.rtl else 0
-          continue
-        
-        color = None
-        if self.tag_color:
-          if ch == "<":
-            inside_tag = True
-            in_tag_name = False
-            expect_tag_name = True
-            color = self.tag_color
-          elif ch == ">":
-            inside_tag = False
-            in_tag_name = False
-            expect_tag_name = False
-            color = self.tag_color
-          elif inside_tag:
-            if expect_tag_name:
-              if ch == "/":
-                color = self.tag_color
-                expect_tag_name = True
-              elif ch.isalpha():
-                in_tag_name = True
-                expect_tag_name = False
-                color = self.tag_color
-              else:
-                expect_tag_name = False
-                color = None
-            elif in_tag_name:
-              if ch.isalnum() or ch in "-:":
-                color = self.tag_color
-              else:
-                in_tag_name = False
-                color = None
-
-        w = font.measure(ch)
-        color = None  
-
-        if self.rtl:
-          if self.cursor_x - w < 0:
-            self.flush()
-          x = self.cursor_x - w
-          self.line.append((x, self.cursor_y, ch, font, color))
-          self.cursor_x -= w
-        else:
-          if self.cursor_x + w >= self.width:
-            self.flush()
-          x = self.cursor_x
-          self.line.append((x, self.cursor_y, ch, font, color))
-          self.cursor_x += w
+      for i, segment in enumerate(text.split("\n")):
+        if i > 0:
+          self.items.append((NEWLINE,))
+        if segment:
+          self.items.append((PRE, segment, font))
       return
 
     out = text.upper() if self.is_abbr else text
-    w = font.measure(out)
-    space = font.measure(" ")
+    self.items.append((WORD, out, font, font.measure(out)))
+
+  def place_word(self, out, font, w):
+    space = font.space_width
 
     if self.rtl:
       if self.cursor_x - w < 0:
@@ -225,20 +226,52 @@ class BlockLayout:
       self.line.append((self.cursor_x, self.cursor_y, out, font, None))
       self.cursor_x += (w + space)
 
+  def pre_runs(self, text, font):
+    # pre 텍스트는 글자마다 따로 두지 않고, 한 줄에 들어가는 만큼을 한 덩어리(run)로 둔다.
+    # 글자 폭은 글리프마다 한 번만 재고, 줄바꿈 위치는 누적 폭 S 에서 이분 탐색으로 찾는다.
+    # (S[k] = text[:k] 의 폭. 글자를 하나씩 놓던 때와 위치/줄바꿈이 같다)
+    S = list(accumulate(font.advances(text), initial=0))
+    start = 0
+    while start < len(text):
+      x = self.cursor_x
+      if self.rtl:
+        end = bisect_right(S, x + S[start], start + 1) - 1
+      else:
+        end = bisect_left(S, self.width - x + S[start], start + 1) - 1
+
+      if end == start:
+        # 첫 글자부터 넘친다. 줄에 뭔가 있으면 줄을 바꾸고 다시 재고, 빈 줄이면 그냥 놓는다.
+        if self.line:
+          self.flush()
+          continue
+        end = start + 1
+
+      width = S[end] - S[start]
+      if self.rtl:
+        # 오른쪽에서 왼쪽으로 놓이므로 왼쪽 끝에서부터 거꾸로 그린다.
+        self.cursor_x -= width
+        self.line.append((self.cursor_x, self.cursor_y, text[start:end][::-1], font, None))
+      else:
+        self.line.append((x, self.cursor_y, text[start:end], font, None))
+        self.cursor_x += width
+
+      start = end
+      if start < len(text):
+        self.flush()
+
   def flush(self):
     if not self.line:
       return
 
-    metrics = [font.metrics() for x, y, word, font, color in self.line]
-    max_ascent = max(m["ascent"] for m in metrics)
-    max_descent = max(m["descent"] for m in metrics)
+    max_ascent = max(font.ascent for x, y, word, font, color in self.line)
+    max_descent = max(font.descent for x, y, word, font, color in self.line)
 
     baseline = self.cursor_y + max_ascent
 
     for x, y, text, font, color in self.line:
-      top = baseline - font.metrics("ascent")
+      top = baseline - font.ascent
       if self.is_sup:
-        top -= font.metrics("ascent") * 0.4
+        top -= font.ascent * 0.4
       self.display_list.append((x, top, text, font, color))
 
     line_height = max_ascent + max_descent
@@ -257,147 +290,196 @@ class BlockLayout:
           return "block"
     return "inline"
 
-  def layout(self):
-    self.x = self.parent.x
-    self.width = self.parent.width
-    self.y = (self.previous.y + self.previous.height) if self.previous else self.parent.y
-
-    mode = self.layout_mode()
-
-    if mode == "block":
-      self.children = []
-      self.display_list = []
-      self.line = []
+  def build_children(self):
+    previous_children = {child.reuse_key(): child for child in self.children}
+    self.children = []
 
-      root = self.nodes[0] if self.nodes else None
+    root = self.nodes[0] if self.nodes else None
 
-      if isinstance(root, Element):
-        children = list(root.children)
-      else:
-        children = list(self.nodes)
+    if isinstance(root, Element):
+      children = list(root.children)
+    else:
+      children = list(self.nodes)
 
-      if self.runin_prefix:
-        children = list(self.runin_prefix) + children
+    if self.runin_prefix:
+      children = list(self.runin_prefix) + children
 
-      if isinstance(root, Element) and root.tag == "nav":
-        nav_id = root.attributes.get("id", "")
-        if isinstance(nav_id, str) and nav_id == "toc":
-          title_el = Element("__toc_title__", {}, root)
-          title_el.children.append(Text("목차", title_el))
-          children = [title_el] + children
+    if isinstance(root, Element) and root.tag == "nav":
+      nav_id = root.attributes.get("id", "")
+      if isinstance(nav_id, str) and nav_id == "toc":
+        title_el = Element("__toc_title__", {}, root)
+        title_el.append_child(Text("목차", title_el))
+        children = [title_el] + children
 
-      def is_inline_node(n):
-        if isinstance(n, Text):
-          return True
-        if isinstance(n, Element):
-          if n.tag in HIDDEN_TAGS:
-            return None
-          if n.tag == "__toc_title__":
-            return False
-          if n.tag == RUN_IN_TAG:
-            return True
-          if n.tag in BLOCK_TAGS:
-            return False
+    def is_inline_node(n):
+      if isinstance(n, Text):
         return True
-
+      if isinstance(n, Element):
+        if n.tag in HIDDEN_TAGS:
+          return None
+        if n.tag == "__toc_title__":
+          return False
+        if n.tag == RUN_IN_TAG:
+          return True
+        if n.tag in BLOCK_TAGS:
+          return False
+      return True
+
+    inline_run = []
+    previous = None
+    pending_runin = None
+
+    def flush_inline_run():
+      nonlocal inline_run, previous
+      if not inline_run:
+        return
+      nxt = BlockLayout(
+        inline_run,
+        self,
+        previous,
+        self.rtl,
+        bold=self.bold,
+        tag_color=self.tag_color,
+      )
+      self.children.append(nxt)
+      previous = nxt
       inline_run = []
-      previous = None
-      pending_runin = None
 
-      def flush_inline_run():
-        nonlocal inline_run, previous
-        if not inline_run:
-          return
-        nxt = BlockLayout(
-          inline_run,
-          self,
-          previous,
-          self.rtl,
-          bold=self.bold,
-          tag_color=self.tag_color,
-        )
-        self.children.append(nxt)
-        previous = nxt
-        inline_run = []
-
-      i = 0
-      while i < len(children):
-        child = children[i]
+    i = 0
+    while i < len(children):
+      child = children[i]
 
-        if isinstance(child, Element) and child.tag == RUN_IN_TAG:
-          pending_runin = child
-          i += 1
-          continue
-
-        flag = is_inline_node(child)
-        if flag is None:
-          i += 1
-          continue
+      if isinstance(child, Element) and child.tag == RUN_IN_TAG:
+        pending_runin = child
+        i += 1
+        continue
 
-        if pending_runin is not None:
-          if flag:
-            inline_run.append(pending_runin)
-            pending_runin = None
-            inline_run.append(child)
-            i += 1
-            continue
-          else:
-            flush_inline_run()
-            nxt = BlockLayout(
-              [child],
-              self,
-              previous,
-              self.rtl,
-              bold=self.bold,
-              tag_color=self.tag_color,
-              runin_prefix=[pending_runin],
-            )
-            self.children.append(nxt)
-            previous = nxt
-            pending_runin = None
-            i += 1
-            continue
+      flag = is_inline_node(child)
+      if flag is None:
+        i += 1
+        continue
 
+      if pending_runin is not None:
         if flag:
+          inline_run.append(pending_runin)
+          pending_runin = None
           inline_run.append(child)
+          i += 1
+          continue
         else:
           flush_inline_run()
-          force_bold = isinstance(child, Element) and child.tag == "__toc_title__"
           nxt = BlockLayout(
             [child],
             self,
             previous,
             self.rtl,
-            bold=(True if force_bold else self.bold),
+            bold=self.bold,
             tag_color=self.tag_color,
+            runin_prefix=[pending_runin],
           )
           self.children.append(nxt)
           previous = nxt
+          pending_runin = None
+          i += 1
+          continue
 
-        i += 1
+      if flag:
+        inline_run.append(child)
+      else:
+        flush_inline_run()
+        force_bold = isinstance(child, Element) and child.tag == "__toc_title__"
+        nxt = BlockLayout(
+          [child],
+          self,
+          previous,
+          self.rtl,
+          bold=(True if force_bold else self.bold),
+          tag_color=self.tag_color,
+        )
+        self.children.append(nxt)
+        previous = nxt
 
-      if pending_runin is not None:
-        inline_run.append(pending_runin)
-        pending_runin = None
+      i += 1
 
-      flush_inline_run()
+    if pending_runin is not None:
+      inline_run.append(pending_runin)
+      pending_runin = None
 
-      for child in self.children:
-        child.layout()
+    flush_inline_run()
 
-      self.height = (
-        (self.children[-1].y + self.children[-1].height) - self.y
-        if self.children
-        else VSTEP
-      )
+    # 같은 노드를 맡는 자식 블록은 예전 것을 그대로 쓴다. (바뀐 게 없으면 layout 에서 y 만 옮겨진다)
+    for i, child in enumerate(self.children):
+      child = self.children[i] = previous_children.get(child.reuse_key(), child)
+      child.previous = self.children[i - 1] if i > 0 else None
+
+  def layout(self, limit=None):
+    # limit 가 있으면 그 y 를 넘어서 시작하는 자식 블록부터는 배치하지 않고 남겨둔다.
+    # 그러면 child_dirty 가 남아서 다음 layout 이 거기서부터 이어간다.
+    x = self.parent.x
+    width = self.parent.width
+    y = (self.previous.y + self.previous.height) if self.previous else self.parent.y
+
+    if not self.dirty and not self.child_dirty and x == self.x and width == self.width:
+      if y != self.y:
+        self.shift(y - self.y)
+      return
+
+    self.x = x
+    self.width = width
+    self.y = y
+
+    mode = self.layout_mode()
+
+    if mode == "block":
+      self.display_list = []
+      self.line = []
+
+      # 어떤 노드가 어떤 자식 블록이 되는지는 폭과 상관없다. 노드가 바뀌었을 때(dirty)만 다시 만들고,
+      # 그 밖의 layout(창 크기 변경, 자손의 변경)은 자식들의 위치와 줄바꿈만 새로 한다.
+      if self.dirty:
+        for n in self.nodes:
+          n.layout_object = self.handle
+        self.build_children()
+
+      self.dirty = self.child_dirty = False
+      self.laid_out = 0
+      self.chars = 0
+      for child in self.children:
+        previous = child.previous
+        if limit is not None and previous is not None and previous.y + previous.height > limit:
+          self.child_dirty = True
+          break
+        child.layout(limit)
+        self.laid_out += 1
+        self.chars += child.chars
+        if child.child_dirty:
+          self.child_dirty = True
+          break
+
+      last = self.children[self.laid_out - 1] if self.laid_out else None
+      self.height = (last.y + last.height) - self.y if last else VSTEP
       return
 
     self.children = []
-    self.display_list = []
-    self.line = []
+    if self.dirty:
+      self.items = None
+      self.line_breaks.clear()
+      self.dirty = self.child_dirty = False
+    if self.items is None:
+      self.collect_items()
+
+    cached = self.line_breaks.get(self.width)
+    if cached is None:
+      cached = self.line_breaks[self.width] = self.break_lines()
+      if len(self.line_breaks) > LINE_BREAK_CACHE_SIZE:
+        self.line_breaks.popitem(last=False)
+    else:
+      self.line_breaks.move_to_end(self.width)
+    self.display_list, self.height = cached
 
-    self.cursor_x = (self.width - HSTEP) if self.rtl else 0
-    self.cursor_y = 0
+  def collect_items(self):
+    self.items = []
+    self.chars = 0
 
     self.weight = "bold" if self.bold else "normal"
     self.style = "roman"
@@ -412,8 +494,33 @@ class BlockLayout:
     for n in self.nodes:
       self.recurse(n)
 
+  def break_lines(self):
+    # 현재 폭으로 items 를 줄에 배치해서 (display_list, height) 를 돌려준다.
+    self.display_list = []
+    self.line = []
+
+    self.cursor_x = (self.width - HSTEP) if self.rtl else 0
+    self.cursor_y = 0
+    self.is_sup = False
+
+    for item in self.items:
+      kind = item[0]
+      if kind == WORD:
+        self.place_word(item[1], item[2], item[3])
+      elif kind == SPACE:
+        self.place_space(item[1])
+      elif kind == PRE:
+        self.pre_runs(item[1], item[2])
+      elif kind == NEWLINE:
+        self.flush()
+        self.cursor_x = (self.width - HSTEP) if self.rtl else 0
+      elif kind == LINE_BREAK:
+        self.flush()
+      else:
+        self.is_sup = item[1]
+
     self.flush()
-    self.height = self.cursor_y
+    return self.display_list, self.cursor_y
 
   def paint(self):
     cmds = []
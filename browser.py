@@ -1,32 +1,47 @@
 import sys
 import tkinter
 
-from url import URL, lex
+from url import URL
+from cache import get_cache_key, get_cache_entry, document_key, load_document, store_document
 from htmlParser import HTMLParser
 from element import Element
 from text import Text
 from documentLayout import DocumentLayout
+from domArena import ArenaParser
 
 INIT_WIDTH, INIT_HEIGHT = 800, 600
 HSTEP, VSTEP = 13, 18
 SCROLL_STEP = 100
+# 긴 문서는 화면과 그 아래 LAYOUT_MARGIN 까지만 먼저 배치해서 그리고,
+# 나머지는 idle 때마다 LAYOUT_STEP 씩 이어서 배치한다.
+LAYOUT_MARGIN = INIT_HEIGHT
+LAYOUT_STEP = 10 * INIT_HEIGHT
 
 
 def paint_tree(layout_object, display_list):
   display_list.extend(layout_object.paint())
-  for child in layout_object.children:
+  # 아직 배치하지 않은 자식은 그리지 않는다.
+  for child in layout_object.children[:layout_object.laid_out]:
     paint_tree(child, display_list)
   return display_list
 
 
 class Browser:
-  def __init__(self, rtl=False):
+  def __init__(self, rtl=False, arena=False):
     self.rtl = rtl
+    self.arena = arena
     self.scroll = 0
     self.content_height = INIT_HEIGHT
     self.display_list = []
     self.text = ""
+    self.nodes = None
     self.is_source = False
+    self.document = None
+    # 창 크기를 끄는 동안 Configure 가 수십 번 온다. 마지막 크기만 idle 때 한 번 반영한다.
+    self.pending_size = None
+    self.resize_job = None
+    self.layout_job = None
+    self.painted_bottom = 0
 
     self.window = tkinter.Tk()
     self.window.title("Marsh Browser")
@@ -50,44 +65,90 @@ class Browser:
 
   def load(self, url_str: str):
     url = URL(url_str)
-    body = url.request()
 
     if url.scheme == "view-source":
       self.is_source = True
-      self.text = body
-      self.render_source(body)
+      self.nodes = None
+      self.text = url.request()
+      self.render_source(self.text)
     else:
       self.is_source = False
-      self.text = lex(body)
-      self.render_html(self.text)
+      cache_key = get_cache_key(url.scheme, url.host, url.port, url.path)
+      # 큰 문서는 객체 트리 대신 배열 기반 DOM 으로 들고 있는다. 파서가 arena 에 바로 쓰므로
+      # 파싱하는 동안에도 Element/Text 트리를 만들지 않는다.
+      parser_class = ArenaParser if self.arena else HTMLParser
+      if get_cache_entry(cache_key) is not None:
+        # 캐시에 있는 문서는 본문이 그대로면(신선하거나 304) 파싱해 둔 DOM 을 다시 쓴다.
+        text = url.request()
+        key = document_key(cache_key, text)
+        self.nodes = load_document(key, arena=self.arena)
+        if self.nodes is None:
+          self.nodes = parser_class(text).parse()
+      else:
+        # 본문을 다 받을 때까지 기다리지 않고, 받는 대로 파서에 넣어서 DOM 을 만든다.
+        parser = parser_class()
+        text = url.request(on_text=parser.feed)
+        self.nodes = parser.close()
+        key = document_key(cache_key, text)
+      store_document(key, self.nodes)
+      self.render_html(self.nodes)
 
     self.draw()
 
-  def render_html(self, text: str):
-    node = HTMLParser(text).parse()
+  def render_html(self, node):
     self.document = DocumentLayout(node, width=self.width, rtl=self.rtl)
-    self.document.layout()
+    self.layout_visible()
+
+  def layout_visible(self):
+    # 지금 보이는 곳까지만 배치해서 그리고, 나머지는 idle 때 이어서 배치한다.
+    self.document.layout(limit=self.scroll + self.height + LAYOUT_MARGIN)
+    self.paint_document()
+    self.schedule_layout()
+
+  def schedule_layout(self):
+    if not self.document.complete and self.layout_job is None:
+      self.layout_job = self.window.after_idle(self.continue_layout)
+
+  def continue_layout(self):
+    self.layout_job = None
+    if self.document is None or self.document.complete:
+      return
+
+    self.document.layout(limit=self.document.layout_bottom + LAYOUT_STEP)
+    if self.document.complete:
+      self.paint_document()
+      self.draw()
+      return
+
+    # 이미 그린 화면은 그대로 두고 스크롤바만 새로 어림한 높이에 맞춘다.
+    self.content_height = max(self.height, self.document.content_height)
+    self.update_scrollbar()
+    self.schedule_layout()
 
+  def paint_document(self):
     self.display_list = []
     paint_tree(self.document, self.display_list)
+    self.painted_bottom = self.document.layout_bottom
 
     self.content_height = max(self.height, self.document.content_height)
     self.clamp_scroll()
 
   def render_source(self, source_text: str):
     root = Element("pre", {}, None)
-    root.children.append(Text(source_text, root))
+    root.append_child(Text(source_text, root))
 
     self.document = DocumentLayout(root, width=self.width, rtl=self.rtl, bold=True, tag_color="#881280")
-    self.document.layout()
-
-    self.display_list = []
-    paint_tree(self.document, self.display_list)
-
-    self.content_height = max(self.height, self.document.content_height)
-    self.clamp_scroll()
+    self.layout_visible()
 
   def draw(self):
+    # idle 배치가 따라오기 전에 아래로 스크롤했으면 보이는 곳까지 먼저 배치해서 그린다.
+    if self.document is not None:
+      bottom = self.scroll + self.height
+      if not self.document.complete and bottom + LAYOUT_MARGIN > self.document.layout_bottom:
+        self.document.layout(limit=bottom + LAYOUT_MARGIN)
+      if bottom > self.painted_bottom and self.document.layout_bottom > self.painted_bottom:
+        self.paint_document()
+
     self.canvas.delete("all")
 
     for cmd in self.display_list:
@@ -119,15 +180,31 @@ class Browser:
     self.draw()
 
   def configure(self, e):
-    self.width = e.width
-    self.height = e.height
-    if self.text:
-      if self.is_source:
-        self.render_source(self.text)
-      else:
-        self.render_html(self.text)
+    self.pending_size = (e.width, e.height)
+    if self.resize_job is None:
+      self.resize_job = self.window.after_idle(self.apply_resize)
+
+  def apply_resize(self):
+    self.resize_job = None
+    width, height = self.pending_size
+    width_changed = width != self.width
+    self.width, self.height = width, height
+
+    if self.document is None:
+      self.draw()
+      return
+
+    # 높이만 바뀌었으면 레이아웃은 그대로다. DOM 도 다시 파싱하지 않는다.
+    if width_changed:
+      self.document.resize(width, limit=self.scroll + self.height + LAYOUT_MARGIN)
+      self.paint_document()
+      self.schedule_layout()
+    else:
+      self.content_height = max(self.height, self.document.content_height)
+      self.clamp_scroll()
     self.draw()
 
+
   def clamp_scroll(self):
     max_scroll = max(0, self.content_height - self.height)
     if self.scroll < 0:
@@ -170,13 +247,18 @@ class Browser:
 
 if __name__ == "__main__":
   rtl = False
+  arena = False
   url_arg_index = 1
 
-  if len(sys.argv) >= 2 and sys.argv[1] == "--rtl":
-    rtl = True
-    url_arg_index = 2
+  while len(sys.argv) > url_arg_index and sys.argv[url_arg_index] in ["--rtl", "--arena"]:
+    if sys.argv[url_arg_index] == "--rtl":
+      rtl = True
+    else:
+      arena = True
+    url_arg_index += 1
+
+  b = Browser(rtl=rtl, arena=arena)
 
-  b = Browser(rtl=rtl)
 
   if len(sys.argv) < url_arg_index + 1:
     b.load("")
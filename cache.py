@@ -1,62 +1,355 @@
+import email.utils
+import hashlib
+import sys
+import threading
 import tkinter.font as tkfont
 import time
+from collections import OrderedDict
 from typing import Optional
 
-# key: (scheme, host, port, path) -> {"expires_at": float 또는 None, "body": str}
-_CACHE = {}
+import diskCache
+from domArena import DOMArena, ArenaElement
+
+MAX_DOCUMENTS = 16
+MAX_MEASURED_WORDS = 4096
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+MAX_ENTRY_BYTES = 8 * 1024 * 1024
+SWEEP_INTERVAL = 60.0
+
+# key: (scheme, host, port, path) -> {"body": str, "headers": dict, "status": str, "expires_at": float, "size": int}
+# 최근에 쓴 것이 뒤로 가는 LRU. 합이 MAX_CACHE_BYTES 를 넘으면 앞에서부터 버린다.
+# 여기 없으면 diskCache 를 본다. 디스크에서 온 항목은 body 가 None 이고 _body 로 읽는다.
+# _CACHE_LOCK 은 메모리 계층만 지킨다. 디스크 읽기/쓰기는 락 밖에서 한다. (diskCache 는 자기 락을 쓴다)
+# 신선도가 지난 항목도 검증자(ETag / Last-Modified)가 있으면 조건부 요청에 쓰려고 남겨둔다.
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+_CACHE_STATS = {"hits": 0, "misses": 0, "revalidated": 0, "evictions": 0, "expired": 0, "bytes": 0}
+_LAST_SWEEP = [0.0]
+# (cache key, 검증자) -> 파싱한 DOM 의 DOMArena. 같은 본문이면 다시 파싱하지 않는다.
+# 살아있는 트리를 두면 페이지에서 고친 DOM 이 다음 로드에 그대로 나오므로, 읽기 전용인 arena 로 두고
+# load_document 때마다 새 트리를 만들어 준다.
+_DOCUMENTS = OrderedDict()
 # key: (family, size, weight, style)
 _FONTS = {}
 
+# 캐시 항목에 남겨두는 응답 헤더
+STORED_HEADERS = ("cache-control", "expires", "date", "age", "etag", "last-modified")
+# 명시적인 신선도가 없어도 저장할 수 있는 상태 코드 (RFC 9110 15.1)
+CACHEABLE_STATUSES = ("200", "203", "204", "300", "404", "405", "410", "414", "501")
+# Last-Modified 로 추정하는 신선도: 지난 시간의 10%, 최대 하루
+HEURISTIC_FRACTION = 0.1
+HEURISTIC_MAX = 24 * 60 * 60
+
 def get_cache_key(scheme: str, host: str, port: Optional[int], path: str):
   if scheme in ["http", "https"]:
     return (scheme, host, port, path)
   return None
 
-def load_from_cache(cache_key):
+def _directives(headers) -> dict:
+  directives = {}
+  for d in headers.get("cache-control", "").split(","):
+    name, _, value = d.strip().partition("=")
+    if name:
+      directives[name.lower()] = value.strip().strip('"')
+  return directives
+
+def _seconds(value) -> Optional[int]:
+  try:
+    return max(0, int(value))
+  except ValueError:
+    return None
+
+def _http_date(value) -> Optional[float]:
+  if not value:
+    return None
+  try:
+    return email.utils.parsedate_to_datetime(value).timestamp()
+  except (TypeError, ValueError, IndexError):
+    return None
+
+def _expires_at(headers, status, now) -> float:
+  # 응답이 언제까지 신선한지 (RFC 9111 4.2.1, 4.2.3). 0 이하면 쓰기 전에 검증해야 한다.
+  directives = _directives(headers)
+  if "no-cache" in directives:
+    return 0
+
+  date = _http_date(headers.get("date")) or now
+  age = max(now - date, _seconds(headers.get("age", "")) or 0)
+
+  # s-maxage 는 공유 캐시에만 해당한다. 이 캐시는 브라우저 하나만 쓰는 개인 캐시라 무시한다.
+  lifetime = _seconds(directives["max-age"]) if "max-age" in directives else None
+  if lifetime is None and "expires" in headers:
+    expires = _http_date(headers["expires"])
+    # 형식이 잘못된 Expires 는 이미 지난 것으로 본다.
+    lifetime = max(0, expires - date) if expires is not None else 0
+  if lifetime is None:
+    last_modified = _http_date(headers.get("last-modified"))
+    if last_modified is not None and status in CACHEABLE_STATUSES:
+      lifetime = min(HEURISTIC_MAX, max(0, date - last_modified) * HEURISTIC_FRACTION)
+  if lifetime is None:
+    return 0
+  return now + lifetime - age
+
+def load_from_cache(cache_key, on_text=None):
+  # 신선한 본문만 돌려준다. on_text 를 주면 본문을 넘겨준다. (디스크에서 읽는 본문은 읽는 대로 조각조각)
   if cache_key is None:
     return None
+  now = time.time()
+  with _CACHE_LOCK:
+    _sweep(now)
+    entry = _touch(cache_key)
+    if entry is not None:
+      fresh = entry["expires_at"] >= now
+      _CACHE_STATS["hits" if fresh else "misses"] += 1
+      body = entry["body"] if fresh else None
+  if entry is not None:
+    if body is not None and on_text is not None:
+      on_text(body)
+    return body
+
+  entry = _disk_entry(cache_key)
+  body = _body(entry, on_text) if entry is not None and entry["expires_at"] >= now else None
+  with _CACHE_LOCK:
+    if body is None:
+      _CACHE_STATS["misses"] += 1
+      return None
+    _CACHE_STATS["hits"] += 1
+    if cache_key not in _CACHE:
+      # 디스크에서 읽은 본문은 다음부터 메모리에서 바로 준다.
+      _put(cache_key, entry["headers"], body, entry["status"], entry["expires_at"])
+  return body
 
+def get_cache_entry(cache_key):
+  # 신선하지 않아도 돌려준다. 조건부 요청(validator_headers)과 update_from_304 에 쓴다.
+  if cache_key is None:
+    return None
+  with _CACHE_LOCK:
+    entry = _touch(cache_key)
+  if entry is not None:
+    return entry
+  return _disk_entry(cache_key)
+
+def _disk_entry(cache_key):
+  record = diskCache.load_record(cache_key)
+  if record is None:
+    return None
+  if record["expires_at"] < time.time() and not _has_validator(record["headers"]):
+    diskCache.remove(cache_key)
+    return None
+  return {
+    "expires_at": record["expires_at"],
+    "body": None,
+    "headers": record["headers"],
+    "status": record["status"],
+    "size": record["length"],
+    "record": record,
+  }
+
+def _body(entry, on_text=None):
+  if entry["body"] is not None:
+    return entry["body"]
+  return diskCache.read_body(entry["record"], on_text)
+
+def _touch(cache_key):
   entry = _CACHE.get(cache_key)
+  if entry is not None:
+    _CACHE.move_to_end(cache_key)
+  return entry
+
+def validator_headers(entry) -> dict:
+  if entry is None:
+    return {}
+  headers = {}
+  if "etag" in entry["headers"]:
+    headers["If-None-Match"] = entry["headers"]["etag"]
+  if "last-modified" in entry["headers"]:
+    headers["If-Modified-Since"] = entry["headers"]["last-modified"]
+  return headers
+
+def update_from_304(cache_key, entry, response_headers: dict) -> str:
+  # 304 Not Modified: 저장해 둔 본문에 새 헤더를 덮어쓰고 신선도를 다시 계산한다 (RFC 9111 4.3.4).
+  headers = dict(entry["headers"])
+  headers.update(_stored_headers(response_headers))
+  # 그 사이 디스크의 본문 파일이 지워졌으면 빈 본문밖에 줄 게 없다.
+  body = _body(entry) or ""
+  with _CACHE_LOCK:
+    _CACHE_STATS["revalidated"] += 1
+    expires_at = _store(cache_key, headers, body, entry["status"])
+  _write_disk(cache_key, headers, body, entry["status"], expires_at)
+  return body
+
+def stale_body(entry):
+  # 서버에 닿지 못했을 때 대신 보여줄 수 있는 오래된 본문 (RFC 9111 4.2.4).
   if entry is None:
     return None
+  directives = _directives(entry["headers"])
+  if "must-revalidate" in directives or "no-cache" in directives:
+    return None
+  return _body(entry)
+
+def _stored_headers(response_headers: dict) -> dict:
+  return {h: response_headers[h] for h in STORED_HEADERS if h in response_headers}
 
+def store_in_cache(cache_key, response_headers: dict, body: str, status="200"):
+  if cache_key is None:
+    return
+
+  directives = _directives(response_headers)
+  if "no-store" in directives:
+    with _CACHE_LOCK:
+      _remove(cache_key)
+    diskCache.remove(cache_key)
+    return
+
+  explicit = "max-age" in directives or "expires" in response_headers
+  if status not in CACHEABLE_STATUSES and not explicit:
+    return
+  headers = _stored_headers(response_headers)
+  with _CACHE_LOCK:
+    expires_at = _store(cache_key, headers, body, status)
+  _write_disk(cache_key, headers, body, status, expires_at)
+
+def _store(cache_key, headers, body, status):
+  # 메모리 계층만 고치고, 디스크에 쓸 expires_at 을 돌려준다. (둘 이유가 없으면 None)
+  # 디스크 쓰기는 호출한 쪽이 락을 놓은 뒤 _write_disk 로 한다.
   now = time.time()
-  expires_at = entry["expires_at"]
+  _sweep(now)
+  _remove(cache_key)
 
-  if expires_at is not None and expires_at >= now:
-    return entry["body"]
+  expires_at = _expires_at(headers, status, now)
+  if expires_at <= now and not _has_validator(headers):
+    # 바로 상했고 검증할 방법도 없으면 둘 이유가 없다.
+    return None
+  _put(cache_key, headers, body, status, expires_at)
+  return expires_at
 
-  _CACHE.pop(cache_key, None)
-  return None
+def _write_disk(cache_key, headers, body, status, expires_at):
+  if expires_at is None:
+    diskCache.remove(cache_key)
+  else:
+    diskCache.store(cache_key, headers, status, expires_at, body)
 
-def store_in_cache(cache_key, response_headers: dict, body: str):
-  if cache_key is None:
+def _put(cache_key, headers, body, status, expires_at):
+  # 메모리 계층에만 넣는다. 너무 큰 본문은 디스크에만 둔다.
+  size = sys.getsizeof(body)
+  if size > MAX_ENTRY_BYTES:
     return
 
-  cache_control = response_headers.get("cache-control", "")
-  if not cache_control:
+  _CACHE[cache_key] = {
+    "expires_at": expires_at,
+    "body": body,
+    "headers": headers,
+    "status": status,
+    "size": size,
+  }
+  _CACHE_STATS["bytes"] += size
+  while _CACHE_STATS["bytes"] > MAX_CACHE_BYTES:
+    _remove(next(iter(_CACHE)))
+    _CACHE_STATS["evictions"] += 1
+
+def _has_validator(headers) -> bool:
+  return "etag" in headers or "last-modified" in headers
+
+def _remove(cache_key):
+  entry = _CACHE.pop(cache_key, None)
+  if entry is not None:
+    _CACHE_STATS["bytes"] -= entry["size"]
+
+def _sweep(now):
+  # SWEEP_INTERVAL 마다 상했고 검증자도 없는 항목을 치운다. (읽히지 않는 항목이 계속 남지 않게)
+  if now - _LAST_SWEEP[0] < SWEEP_INTERVAL:
     return
+  _LAST_SWEEP[0] = now
+  for cache_key, entry in list(_CACHE.items()):
+    if entry["expires_at"] <= now and not _has_validator(entry["headers"]):
+      _remove(cache_key)
+      _CACHE_STATS["expired"] += 1
 
-  directives = [d.strip().lower() for d in cache_control.split(",")]
+def clear_cache():
+  with _CACHE_LOCK:
+    _CACHE.clear()
+    _CACHE_STATS["bytes"] = 0
 
-  if "no-store" in directives:
+def get_cache_stats():
+  with _CACHE_LOCK:
+    stats = dict(_CACHE_STATS)
+    stats["entries"] = len(_CACHE)
+  return stats
+
+def document_key(cache_key, body: str):
+  # 문서 캐시의 키. 응답 캐시 항목의 ETag / Last-Modified 를, 없으면 본문 해시를 검증자로 쓴다.
+  # 응답 캐시에 없는 문서는 다음에도 새로 받아 파싱할 것이므로 None.
+  if cache_key is None:
+    return None
+  entry = get_cache_entry(cache_key)
+  if entry is None:
+    return None
+  validator = entry["headers"].get("etag") or entry["headers"].get("last-modified")
+  if validator:
+    return (cache_key, validator)
+  return (cache_key, hashlib.sha1(body.encode("utf-8", "surrogatepass")).hexdigest())
+
+def load_document(document_key, arena=False):
+  # 새 Element/Text 트리를, arena 면 arena 의 읽기 전용 루트 뷰를 돌려준다. (뷰는 고칠 수 없으니 같이 써도 된다)
+  if document_key is None:
+    return None
+  with _CACHE_LOCK:
+    document = _DOCUMENTS.get(document_key)
+    if document is None:
+      return None
+    _DOCUMENTS.move_to_end(document_key)
+  return document.root() if arena else document.to_tree()
+
+def store_document(document_key, root):
+  if document_key is None or root is None:
     return
+  # ArenaParser 가 만든 문서는 이미 arena 다.
+  arena = root.arena if isinstance(root, ArenaElement) else DOMArena.from_tree(root)
+  with _CACHE_LOCK:
+    _DOCUMENTS[document_key] = arena
+    _DOCUMENTS.move_to_end(document_key)
+    while len(_DOCUMENTS) > MAX_DOCUMENTS:
+      _DOCUMENTS.popitem(last=False)
 
-  expires_at = None
-  for d in directives:
-    if d.startswith("max-age="):
-      try:
-        seconds = int(d.split("=", 1)[1])
-        expires_at = time.time() + seconds
-      except ValueError:
-        pass
-      break 
-
-  if expires_at is not None:
-    _CACHE[cache_key] = {
-      "expires_at": expires_at,
-      "body": body,
-    }
+class CachedFont(tkfont.Font):
+  # measure / metrics 는 매번 Tk 를 다녀온다. 단어 폭은 글꼴마다 LRU 로 기억하고,
+  # 공백 폭과 ascent / descent / linespace 는 만들 때 한 번만 물어본다.
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.widths = OrderedDict()
+    self.glyph_widths = {}
+    self._metrics = super().metrics()
+    self.ascent = self._metrics["ascent"]
+    self.descent = self._metrics["descent"]
+    self.linespace = self._metrics["linespace"]
+    self.space_width = self.measure(" ")
+
+  def measure(self, text, displayof=None):
+    if displayof is not None:
+      return super().measure(text, displayof)
+    width = self.widths.get(text)
+    if width is None:
+      width = super().measure(text)
+      self.widths[text] = width
+      if len(self.widths) > MAX_MEASURED_WORDS:
+        self.widths.popitem(last=False)
+    else:
+      self.widths.move_to_end(text)
+    return width
+
+  def advances(self, text):
+    # 글자마다의 폭. 처음 보는 글리프만 Tk 에 묻는다.
+    glyphs = self.glyph_widths
+    for ch in set(text).difference(glyphs):
+      glyphs[ch] = super().measure(ch)
+    return list(map(glyphs.__getitem__, text))
+
+  def metrics(self, *options, **kwargs):
+    if kwargs:
+      return super().metrics(*options, **kwargs)
+    if options:
+      return self._metrics[options[0]]
+    return dict(self._metrics)
 
 def get_font(size, weight, style, family=None):
   key = (family or "default", size, weight, style)
@@ -64,9 +357,9 @@ def get_font(size, weight, style, family=None):
   if key not in _FONTS:
     if family:
       try:
-        _FONTS[key] = tkfont.Font(family=family, size=size, weight=weight, slant=style)
+        _FONTS[key] = CachedFont(family=family, size=size, weight=weight, slant=style)
       except:
-        _FONTS[key] = tkfont.Font(family="Courier New", size=size, weight=weight, slant=style)
+        _FONTS[key] = CachedFont(family="Courier New", size=size, weight=weight, slant=style)
     else:
-      _FONTS[key] = tkfont.Font(size=size, weight=weight, slant=style)
+      _FONTS[key] = CachedFont(size=size, weight=weight, slant=style)
   return _FONTS[key]
@@ -1,17 +1,28 @@
+import select
 import socket
 import ssl
+import threading
+import time
+from collections import OrderedDict
 from typing import Optional
 
-# key: (scheme, host, port) -> socket
-_CONNECTIONS = {}
+MAX_IDLE_PER_HOST = 6
+MAX_IDLE_TOTAL = 32
+MAX_ACTIVE_PER_HOST = 6
+IDLE_TIMEOUT = 30.0
 
-def get_connection(scheme: str, host: str, port: Optional[int]):
-  key = (scheme, host, port)
+# 소켓은 한 번에 한 요청만 빌려 쓴다(get_connection -> release_connection / close_connection).
+# 쉬고 있는 소켓만 보관한다. socket -> ((scheme, host, port), 반납 시각), 오래된 것부터
+_IDLE = OrderedDict()
+# (scheme, host, port) -> 빌려간 소켓 수 (연결 중인 것 포함)
+_ACTIVE = {}
+# 지금 빌려가 있는 소켓. 이미 돌려받은 소켓이 또 돌아오면 무시한다.
+_BORROWED = set()
+_LOCK = threading.Condition()
 
-  sock = _CONNECTIONS.get(key)
-  if sock is not None:
-    return sock, key
+_STATS = {"hits": 0, "misses": 0, "evictions": 0, "stale": 0}
 
+def _open_connection(scheme: str, host: str, port: Optional[int]):
   sock = socket.socket(
     family=socket.AF_INET,
     type=socket.SOCK_STREAM,
@@ -22,22 +33,131 @@ def get_connection(scheme: str, host: str, port: Optional[int]):
   if scheme == "https":
     ctx = ssl.create_default_context()
     sock = ctx.wrap_socket(sock, server_hostname=host)
+  return sock
+
+def _close_socket(sock):
+  try:
+    sock.close()
+  except OSError:
+    pass
+
+def _is_alive(sock) -> bool:
+  # 쉬는 소켓이 읽을 수 있는 상태라면 서버가 닫았거나(EOF) 예상치 못한 데이터가 온 것이다.
+  try:
+    if isinstance(sock, ssl.SSLSocket) and sock.pending():
+      return False
+    readable, _, _ = select.select([sock], [], [], 0)
+  except (OSError, ValueError):
+    return False
+  return not readable
+
+def _evict(sock):
+  _IDLE.pop(sock, None)
+  _close_socket(sock)
+  _STATS["evictions"] += 1
+
+def _evict_expired(now: float):
+  while _IDLE:
+    sock, (_key, released_at) = next(iter(_IDLE.items()))
+    if now - released_at < IDLE_TIMEOUT:
+      break
+    _evict(sock)
 
-  _CONNECTIONS[key] = sock
-  return sock, key
+def _take_idle(key):
+  for sock in reversed(_IDLE):
+    if _IDLE[sock][0] == key:
+      del _IDLE[sock]
+      return sock
+  return None
+
+def _checkin(key):
+  # 호스트의 자리를 하나 돌려놓는다. 소켓을 돌려받을 때는 _take_back 으로 두 번째 반납을 걸러낸 뒤에 부른다.
+  count = _ACTIVE[key] - 1
+  if count > 0:
+    _ACTIVE[key] = count
+  else:
+    del _ACTIVE[key]
+  _LOCK.notify_all()
+
+def _take_back(sock) -> bool:
+  # 빌려간 소켓이면 목록에서 빼고 True. 이미 돌려받은 소켓이면 False (자리는 하나만 돌려놓아야 한다)
+  if sock not in _BORROWED:
+    return False
+  _BORROWED.remove(sock)
+  return True
+
+def get_connection(scheme: str, host: str, port: Optional[int], reuse: bool = True):
+  # (socket, key, reused) 를 돌려준다. reused 면 예전에 쓰던 keep-alive 소켓이다.
+  # 호스트당 MAX_ACTIVE_PER_HOST 개가 이미 나가 있으면 하나가 돌아올 때까지 기다린다.
+  key = (scheme, host, port)
+  while True:
+    with _LOCK:
+      while _ACTIVE.get(key, 0) >= MAX_ACTIVE_PER_HOST:
+        _LOCK.wait()
+      _evict_expired(time.monotonic())
+      sock = _take_idle(key) if reuse else None
+      _ACTIVE[key] = _ACTIVE.get(key, 0) + 1
+      if sock is None:
+        _STATS["misses"] += 1
 
-def close_connection(key):
-  sock = _CONNECTIONS.pop(key, None)
-  if sock is not None:
-    try:
-      sock.close()
-    except OSError:
-      pass
+    # 연결/상태 확인은 락 밖에서 한다. 이 소켓은 이미 이 요청만의 것이다.
+    if sock is None:
+      try:
+        sock = _open_connection(scheme, host, port)
+      except BaseException:
+        with _LOCK:
+          _checkin(key)
+        raise
+      with _LOCK:
+        _BORROWED.add(sock)
+      return sock, key, False
+
+    if _is_alive(sock):
+      with _LOCK:
+        _STATS["hits"] += 1
+        _BORROWED.add(sock)
+      return sock, key, True
+
+    _close_socket(sock)
+    with _LOCK:
+      _STATS["stale"] += 1
+      _checkin(key)
+
+def release_connection(key, sock):
+  # 응답을 끝까지 읽은 소켓을 다음 요청을 위해 돌려놓는다.
+  with _LOCK:
+    if not _take_back(sock):
+      return
+    _IDLE[sock] = (key, time.monotonic())
+    _IDLE.move_to_end(sock)
+
+    same_host = [s for s, (k, _) in _IDLE.items() if k == key]
+    for s in same_host[:max(0, len(same_host) - MAX_IDLE_PER_HOST)]:
+      _evict(s)
+
+    while len(_IDLE) > MAX_IDLE_TOTAL:
+      _evict(next(iter(_IDLE)))
+
+    _checkin(key)
+
+def close_connection(key, sock):
+  _close_socket(sock)
+  with _LOCK:
+    if _take_back(sock):
+      _checkin(key)
+    else:
+      # 돌려받아 쉬고 있던 소켓이면 목록에서만 뺀다.
+      _IDLE.pop(sock, None)
 
 def close_all():
-  for key, sock in list(_CONNECTIONS.items()):
-    try:
-      sock.close()
-    except OSError:
-      pass
-  _CONNECTIONS.clear()
+  with _LOCK:
+    for sock in list(_IDLE):
+      _close_socket(sock)
+    _IDLE.clear()
+
+def get_stats():
+  with _LOCK:
+    stats = dict(_STATS)
+    stats["idle"] = len(_IDLE)
+    stats["in_use"] = sum(_ACTIVE.values())
+  return stats
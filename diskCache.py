@@ -0,0 +1,202 @@
+import codecs
+import hashlib
+import json
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+# 응답 캐시의 디스크 계층. 본문은 내용의 sha256 이름으로 bodies/ 아래에 한 번만 쓰고,
+# 어떤 키가 어떤 본문을 가리키는지는 index.jsonl 에 한 줄씩 덧붙인다. (시작할 때 처음부터 다시 읽는다)
+CACHE_DIR = os.environ.get("BROWSER_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "browser")
+INDEX_FILE = "index.jsonl"
+MAX_DISK_BYTES = 256 * 1024 * 1024
+MAX_DISK_ENTRY_BYTES = 64 * 1024 * 1024
+# read_body 가 on_text 로 넘길 때 한 번에 디코딩하는 크기
+READ_SLICE = 64 * 1024
+
+# key -> {"digest", "headers", "status", "expires_at", "length"}, 마지막으로 저장한 것이 뒤
+_INDEX = OrderedDict()
+# digest -> 그 본문을 가리키는 키 수
+_REFS = {}
+_LOCK = threading.Lock()
+_STATE = {"loaded": False, "disabled": False, "lines": 0, "bytes": 0}
+_STATS = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+def _index_path():
+  return os.path.join(CACHE_DIR, INDEX_FILE)
+
+def _body_path(digest):
+  return os.path.join(CACHE_DIR, "bodies", digest[:2], digest[2:])
+
+def _ensure_loaded():
+  # 디스크를 쓸 수 없으면 디스크 계층만 끄고 메모리 캐시는 그대로 쓴다.
+  if _STATE["loaded"]:
+    return not _STATE["disabled"]
+  _STATE["loaded"] = True
+  try:
+    os.makedirs(os.path.join(CACHE_DIR, "bodies"), exist_ok=True)
+    if os.path.exists(_index_path()):
+      with open(_index_path(), "r", encoding="utf-8") as f:
+        for line in f:
+          _STATE["lines"] += 1
+          try:
+            record = json.loads(line)
+          except ValueError:
+            continue
+          key = tuple(record.pop("key"))
+          if record.get("removed"):
+            _forget(key)
+          else:
+            _remember(key, record)
+  except OSError:
+    _STATE["disabled"] = True
+  return not _STATE["disabled"]
+
+def _remember(key, record):
+  _forget(key)
+  _INDEX[key] = record
+  _REFS[record["digest"]] = _REFS.get(record["digest"], 0) + 1
+  _STATE["bytes"] += record["length"]
+
+def _forget(key):
+  # 인덱스에서 빼고, 아무도 가리키지 않는 본문 digest 를 돌려준다.
+  record = _INDEX.pop(key, None)
+  if record is None:
+    return None
+  _STATE["bytes"] -= record["length"]
+  digest = record["digest"]
+  _REFS[digest] -= 1
+  if _REFS[digest] == 0:
+    del _REFS[digest]
+    return digest
+  return None
+
+def _unlink(digest):
+  if digest is None:
+    return
+  path = _body_path(digest)
+  try:
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+  except OSError:
+    pass
+
+def _append(key, record):
+  line = json.dumps(dict(record, key=list(key)), separators=(",", ":"))
+  with open(_index_path(), "a", encoding="utf-8") as f:
+    f.write(line + "\n")
+  _STATE["lines"] += 1
+  # 덮어쓰거나 지운 줄이 쌓이면 살아있는 항목만으로 다시 쓴다.
+  if _STATE["lines"] > 2 * len(_INDEX) + 100:
+    _compact()
+
+def _compact():
+  tmp = _index_path() + ".tmp"
+  with open(tmp, "w", encoding="utf-8") as f:
+    for key, record in _INDEX.items():
+      f.write(json.dumps(dict(record, key=list(key)), separators=(",", ":")) + "\n")
+  os.replace(tmp, _index_path())
+  _STATE["lines"] = len(_INDEX)
+
+def load_record(key):
+  # 본문을 빼고 헤더/신선도만 돌려준다. 본문은 read_body 로 필요할 때 읽는다.
+  with _LOCK:
+    if not _ensure_loaded():
+      return None
+    record = _INDEX.get(key)
+    _STATS["hits" if record is not None else "misses"] += 1
+    return dict(record) if record is not None else None
+
+def read_body(record, on_text=None):
+  # 본문 파일을 mmap 해서 bytes 로 읽어 들이지 않고 바로 디코딩한다.
+  # on_text 를 주면 READ_SLICE 씩 디코딩해서 넘긴다. 돌려주는 값은 어느 쪽이든 전체 본문이다.
+  if record["length"] == 0:
+    return ""
+  try:
+    f = open(_body_path(record["digest"]), "rb")
+  except OSError:
+    return None
+  with f:
+    try:
+      mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+      return None
+    with mapped:
+      view = memoryview(mapped)
+      try:
+        if on_text is None:
+          try:
+            return str(view, "utf-8", "surrogatepass")
+          except ValueError:
+            return None
+        decoder = codecs.getincrementaldecoder("utf-8")("surrogatepass")
+        parts = []
+        for start in range(0, len(view), READ_SLICE):
+          text = decoder.decode(view[start:start + READ_SLICE], final=start + READ_SLICE >= len(view))
+          if text:
+            parts.append(text)
+            on_text(text)
+        return "".join(parts)
+      finally:
+        view.release()
+
+def store(key, headers, status, expires_at, body):
+  data = body.encode("utf-8", "surrogatepass")
+  if len(data) > MAX_DISK_ENTRY_BYTES:
+    remove(key)
+    return
+  digest = hashlib.sha256(data).hexdigest()
+  record = {
+    "digest": digest,
+    "headers": headers,
+    "status": status,
+    "expires_at": expires_at,
+    "length": len(data),
+  }
+
+  with _LOCK:
+    if not _ensure_loaded():
+      return
+    try:
+      path = _body_path(digest)
+      if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+          f.write(data)
+        os.replace(tmp, path)
+      _STATS["writes"] += 1
+
+      old = _INDEX.get(key)
+      _remember(key, record)
+      if old is not None and old["digest"] not in _REFS:
+        _unlink(old["digest"])
+      _append(key, record)
+
+      while _STATE["bytes"] > MAX_DISK_BYTES and len(_INDEX) > 1:
+        oldest = next(iter(_INDEX))
+        _unlink(_forget(oldest))
+        _append(oldest, {"removed": True})
+        _STATS["evictions"] += 1
+    except OSError:
+      _STATE["disabled"] = True
+
+def remove(key):
+  with _LOCK:
+    if not _ensure_loaded() or key not in _INDEX:
+      return
+    try:
+      _unlink(_forget(key))
+      _append(key, {"removed": True})
+    except OSError:
+      _STATE["disabled"] = True
+
+def get_disk_stats():
+  with _LOCK:
+    _ensure_loaded()
+    stats = dict(_STATS)
+    stats["entries"] = len(_INDEX)
+    stats["bytes"] = _STATE["bytes"]
+    stats["disabled"] = _STATE["disabled"]
+  return stats
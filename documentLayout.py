@@ -1,7 +1,20 @@
-from blockLayout import BlockLayout
+from blockLayout import BlockLayout, HIDDEN_TAGS
+from element import Element
+from text import Text
 
 HSTEP, VSTEP = 13, 18
 
+def count_chars(node):
+  chars = 0
+  stack = [node]
+  while stack:
+    node = stack.pop()
+    if isinstance(node, Text):
+      chars += len(node.text)
+    elif not (isinstance(node, Element) and node.tag in HIDDEN_TAGS):
+      stack.extend(node.children)
+  return chars
+
 class DocumentLayout:
   def __init__(self, node, width, rtl, bold: bool = False, tag_color: str = None):
     self.node = node
@@ -10,28 +23,49 @@ class DocumentLayout:
     self.rtl = rtl
     self.bold = bold
     self.width = width
+    self.viewport_width = width
     self.tag_color = tag_color
 
     self.x = 0
     self.y = 0
     self.height = 0
 
+    # limit 로 일부만 배치했으면 complete 가 False 이고, 남은 높이는 글자 수 비율로 어림한다.
+    self.complete = False
+    self.laid_out = 0
+    self.total_chars = None
+
   @property
-  def content_height(self):
-    return self.y + self.height + VSTEP
+  def layout_bottom(self):
+    return self.y + self.height
 
-  def layout(self):
-    self.children = []
+  @property
+  def content_height(self):
+    if self.complete or not self.children:
+      return self.y + self.height + VSTEP
+    if self.total_chars is None:
+      self.total_chars = count_chars(self.node)
+    laid_chars = max(1, self.children[0].chars)
+    return self.y + max(self.height, int(self.height * self.total_chars / laid_chars)) + VSTEP
 
+  def layout(self, limit=None):
     self.x = HSTEP
     self.y = VSTEP
-    self.width = self.width - 2 * HSTEP
+    self.width = self.viewport_width - 2 * HSTEP
 
-    child = BlockLayout(self.node, self, None, self.rtl, self.bold, self.tag_color)
-    self.children.append(child)
+    if not self.children:
+      self.children.append(BlockLayout(self.node, self, None, self.rtl, self.bold, self.tag_color))
 
-    child.layout()
+    child = self.children[0]
+    child.layout(limit)
     self.height = child.height
+    self.laid_out = 1
+    self.complete = not child.child_dirty
+
+  def resize(self, width, limit=None):
+    # 레이아웃 트리는 그대로 두고 새 폭으로 위치와 줄바꿈만 다시 계산한다.
+    self.viewport_width = width
+    self.layout(limit)
 
   def paint(self):
     return []
@@ -0,0 +1,254 @@
+import sys
+from array import array
+
+from element import Element, NO_ATTRIBUTES
+from htmlParser import HTMLParser
+from text import Text
+
+NONE = -1
+TEXT_TAG = 0
+
+class DOMArena:
+  # Element/Text 객체 대신 노드 정보를 평행 배열에 담는다. 노드 id 는 배열 인덱스, 0 이 루트.
+  def __init__(self):
+    self.tag_names = ["#text"]
+    self.tag_index = {"#text": TEXT_TAG}
+
+    self.tag_ids = array("i")
+    self.parents = array("i")
+    self.first_children = array("i")
+    self.last_children = array("i")
+    self.next_siblings = array("i")
+    self.text_starts = array("q")
+    self.text_ends = array("q")
+
+    # 속성이 있는 element 만: id -> attributes
+    self.attribute_map = {}
+    self.text_buffer = ""
+
+  @classmethod
+  def from_tree(cls, root):
+    arena = cls()
+    if root is None:
+      return arena
+
+    pieces = []
+    offset = 0
+    stack = [(root, NONE)]
+    while stack:
+      node, parent = stack.pop()
+      if isinstance(node, Text):
+        node_id = arena.add_node(TEXT_TAG, parent)
+        arena.text_starts[node_id] = offset
+        offset += len(node.text)
+        arena.text_ends[node_id] = offset
+        pieces.append(node.text)
+      else:
+        node_id = arena.add_node(arena.intern_tag(node.tag), parent)
+        if node.attributes:
+          arena.attribute_map[node_id] = node.attributes
+        for child in reversed(node.children):
+          stack.append((child, node_id))
+
+    arena.text_buffer = "".join(pieces)
+    return arena
+
+  def intern_tag(self, tag):
+    tag_id = self.tag_index.get(tag)
+    if tag_id is None:
+      tag_id = len(self.tag_names)
+      self.tag_names.append(sys.intern(tag))
+      self.tag_index[tag] = tag_id
+    return tag_id
+
+  def add_node(self, tag_id, parent):
+    node_id = len(self.tag_ids)
+    self.tag_ids.append(tag_id)
+    self.parents.append(parent)
+    self.first_children.append(NONE)
+    self.last_children.append(NONE)
+    self.next_siblings.append(NONE)
+    self.text_starts.append(0)
+    self.text_ends.append(0)
+
+    if parent != NONE:
+      last = self.last_children[parent]
+      if last == NONE:
+        self.first_children[parent] = node_id
+      else:
+        self.next_siblings[last] = node_id
+      self.last_children[parent] = node_id
+    return node_id
+
+  def __len__(self):
+    return len(self.tag_ids)
+
+  def is_text(self, node_id):
+    return self.tag_ids[node_id] == TEXT_TAG
+
+  def tag(self, node_id):
+    return self.tag_names[self.tag_ids[node_id]]
+
+  def text(self, node_id):
+    return self.text_buffer[self.text_starts[node_id]:self.text_ends[node_id]]
+
+  def attributes(self, node_id):
+    return self.attribute_map.get(node_id, NO_ATTRIBUTES)
+
+  def parent(self, node_id):
+    return self.parents[node_id]
+
+  def children(self, node_id):
+    child = self.first_children[node_id]
+    while child != NONE:
+      yield child
+      child = self.next_siblings[child]
+
+  def walk(self, node_id=0):
+    # 전위 순회. 재귀 없이 first_child / next_sibling / parent 만 따라간다.
+    if node_id >= len(self):
+      return
+    current = node_id
+    while True:
+      yield current
+      child = self.first_children[current]
+      if child != NONE:
+        current = child
+        continue
+      while current != node_id and self.next_siblings[current] == NONE:
+        current = self.parents[current]
+      if current == node_id:
+        return
+      current = self.next_siblings[current]
+
+  def to_tree(self):
+    # 배열에서 Element/Text 트리를 새로 만든다. 돌려받은 쪽이 고쳐도 arena 는 그대로다.
+    if not len(self):
+      return None
+    nodes = [None] * len(self)
+    for node_id in self.walk():
+      parent = self.parents[node_id]
+      parent_node = nodes[parent] if parent != NONE else None
+      if self.is_text(node_id):
+        node = Text(self.text(node_id), parent_node)
+      else:
+        node = Element(self.tag(node_id), dict(self.attributes(node_id)), parent_node)
+      if parent_node is not None:
+        parent_node.append_child(node)
+      nodes[node_id] = node
+    return nodes[0]
+
+  def node(self, node_id):
+    if node_id == NONE:
+      return None
+    if self.is_text(node_id):
+      return ArenaText(self, node_id)
+    return ArenaElement(self, node_id)
+
+  def root(self):
+    return self.node(0) if len(self) else None
+
+class ArenaElement(Element):
+  # 레이아웃 코드가 Element 처럼 다룰 수 있는 읽기 전용 뷰. 필요할 때마다 만들어 쓴다.
+  __slots__ = ("arena", "id")
+
+  def __init__(self, arena, node_id):
+    self.arena = arena
+    self.id = node_id
+
+  @property
+  def tag(self):
+    return self.arena.tag(self.id)
+
+  @property
+  def attributes(self):
+    return self.arena.attributes(self.id)
+
+  @property
+  def parent(self):
+    return self.arena.node(self.arena.parent(self.id))
+
+  @property
+  def children(self):
+    return [self.arena.node(child) for child in self.arena.children(self.id)]
+
+  def append_child(self, node):
+    raise TypeError("DOMArena nodes are read-only")
+
+  def insert_before(self, node, reference):
+    raise TypeError("DOMArena nodes are read-only")
+
+  def remove_child(self, node):
+    raise TypeError("DOMArena nodes are read-only")
+
+  def __eq__(self, other):
+    return isinstance(other, ArenaElement) and other.arena is self.arena and other.id == self.id
+
+  def __hash__(self):
+    return hash((id(self.arena), self.id))
+
+class ArenaText(Text):
+  __slots__ = ("arena", "id")
+
+  def __init__(self, arena, node_id):
+    self.arena = arena
+    self.id = node_id
+
+  @property
+  def text(self):
+    return self.arena.text(self.id)
+
+  def set_text(self, text):
+    raise TypeError("DOMArena nodes are read-only")
+
+  @property
+  def parent(self):
+    return self.arena.node(self.arena.parent(self.id))
+
+  def __eq__(self, other):
+    return isinstance(other, ArenaText) and other.arena is self.arena and other.id == self.id
+
+  def __hash__(self):
+    return hash((id(self.arena), self.id))
+
+class OpenElement:
+  # ArenaParser 가 열어 둔 element. 파서는 tag 와 append_child 만 쓰고, 노드는 만들 때 이미 arena 에 붙어 있다.
+  __slots__ = ("tag", "id")
+
+  def __init__(self, tag, node_id):
+    self.tag = tag
+    self.id = node_id
+
+  def append_child(self, node):
+    pass
+
+class ArenaParser(HTMLParser):
+  # Element/Text 트리를 만들지 않고 파싱하면서 바로 DOMArena 에 쓴다. close() / parse() 는 arena 의 루트 뷰를 돌려준다.
+  # 열린 element 는 닫힐 때에야 부모에 붙지만, 그동안 부모에 다른 자식이 생기지 않으므로 만들 때 붙여도 순서가 같다.
+  def __init__(self, body=""):
+    super().__init__(body)
+    self.arena = DOMArena()
+    self.pieces = []
+    self.offset = 0
+
+  def new_element(self, tag, attributes, parent):
+    arena = self.arena
+    node_id = arena.add_node(arena.intern_tag(tag), parent.id if parent is not None else NONE)
+    if attributes:
+      arena.attribute_map[node_id] = attributes
+    return OpenElement(tag, node_id)
+
+  def new_text(self, text, parent):
+    arena = self.arena
+    node_id = arena.add_node(TEXT_TAG, parent.id)
+    arena.text_starts[node_id] = self.offset
+    self.offset += len(text)
+    arena.text_ends[node_id] = self.offset
+    self.pieces.append(text)
+    return None
+
+  def close(self):
+    super().close()
+    self.arena.text_buffer = "".join(self.pieces)
+    self.pieces = []
+    return self.arena.root()
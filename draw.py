@@ -4,7 +4,7 @@ class DrawText:
     self.top = y1
     self.text = text
     self.font = font
-    self.bottom = y1 + font.metrics("linespace")
+    self.bottom = y1 + font.linespace
   
   def execute(self, scroll, canvas):
     canvas.create_text(self.left, self.top - scroll, text=self.text, font=self.font, anchor="nw")
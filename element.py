@@ -1,9 +1,52 @@
+import sys
+from types import MappingProxyType
+
+# 자식/속성이 없는 노드끼리 같이 쓰는 빈 값. 처음 추가될 때 실제 list/dict 를 만든다.
+NO_CHILDREN = ()
+NO_ATTRIBUTES = MappingProxyType({})
+
+def mark_dirty(node):
+  # 노드를 배치한 레이아웃 객체(약한 참조)에 내용이 바뀌었다고 알린다.
+  # 아직 레이아웃 전이거나 레이아웃이 이미 버려졌으면 할 일이 없다. (파싱 중 append_child 도 여기서 끝난다)
+  ref = node.layout_object
+  layout = ref() if ref is not None else None
+  if layout is not None:
+    layout.mark_dirty()
+
 class Element:
+  __slots__ = ("tag", "attributes", "children", "parent", "layout_object")
+
   def __init__(self, tag, attributes, parent):
-    self.tag = tag
-    self.attributes = attributes
-    self.children = []
+    self.tag = sys.intern(tag)
+    self.attributes = attributes if attributes else NO_ATTRIBUTES
+    self.children = NO_CHILDREN
     self.parent = parent
+    self.layout_object = None
+
+  def append_child(self, node):
+    if self.children is NO_CHILDREN:
+      self.children = [node]
+    else:
+      self.children.append(node)
+    if self.layout_object is not None:
+      mark_dirty(self)
+
+  def insert_before(self, node, reference):
+    if reference is None:
+      self.append_child(node)
+      return
+    if self.children is NO_CHILDREN:
+      raise ValueError("reference is not a child of this element")
+    self.children.insert(self.children.index(reference), node)
+    node.parent = self
+    mark_dirty(self)
+
+  def remove_child(self, node):
+    if self.children is NO_CHILDREN:
+      raise ValueError("node is not a child of this element")
+    self.children.remove(node)
+    node.parent = None
+    mark_dirty(self)
 
   def __repr__(self):
-    return "<" + self.tag + ">"
\ No newline at end of file
+    return "<" + self.tag + ">"
@@ -1,5 +1,6 @@
 from urllib.request import urlopen
-import shlex
+import html
+import re
 
 from text import Text
 from element import Element
@@ -8,34 +9,134 @@ SELF_CLOSING_TAGS = [
   "area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"
 ]
 
+TEXT, TAG = "text", "tag"
+
+TAG_NAME = re.compile(r"\s*(/?[^\s/]*)")
+# 이름 / 이름=값 / 이름="값" / 이름='값'. 닫히지 않은 따옴표는 태그 끝까지를 값으로 본다.
+ATTRIBUTE = re.compile(r"""([^\s/="']+)(?:\s*(=)\s*(?:"([^"]*)"?|'([^']*)'?|([^\s]*)))?""")
+
+def decode_entities(text):
+  return html.unescape(text) if "&" in text else text
+
 HEAD_TAGS = ["base", "basefont", "bgsound", "noscript", "link", "meta", "title", "style", "script"]
 
 class HTMLParser:
-  def __init__(self, body):
+  # 노드를 만든다. (tag, attributes, parent) / (text, parent) 로 부르고, 부모의 append_child 로 붙인다.
+  # DOMArena 에 바로 쓰는 ArenaParser 는 이 둘만 바꾼다.
+  new_element = Element
+  new_text = Text
+
+  def __init__(self, body=""):
     self.body = body
     self.unfinished = []
+    # tag -> self.unfinished 안에 열려 있는 개수
+    self.open_counts = {}
+    self.pending = []
+    # pending 이 끝나지 않은 주석/태그로 시작하면 그걸 끝낼 문자열("-->" / ">").
+    # 그게 올 때까지는 새 조각(과 경계에 걸친 tail)만 보고, 쌓인 본문을 다시 훑지 않는다.
+    self.waiting_for = None
+    self.tail = ""
 
   def parse(self):
-    text = ""
-    in_tag = False
-
-    for c in self.body:
-      if c == "<":
-        in_tag = True
-        if text: self.add_text(text)
-        text = ""
-      elif c == ">":
-        in_tag = False
-        self.add_tag(text)
-        text = ""
-      else:
-        text += c
+    self.feed(self.body)
+    return self.close()
 
-    if not in_tag and text:
-      self.add_text(text)
+  def feed(self, chunk):
+    # 소켓에서 받은 조각을 바로 넣는다. 끝나지 않은 텍스트/태그는 다음 조각이 올 때까지 남겨둔다.
+    if not chunk:
+      return
+    self.pending.append(chunk)
+    probe = self.tail + chunk
+    self.tail = probe[-2:]
+    if self.waiting_for is not None:
+      if self.waiting_for not in probe:
+        return
+    elif "<" not in chunk and ">" not in chunk:
+      return
 
+    body = "".join(self.pending)
+    self.pending = []
+    self.waiting_for = None
+    self.handle_tokens(self.tokenize(body, final=False))
+
+  def close(self):
+    body = "".join(self.pending)
+    self.pending = []
+    self.waiting_for = None
+    self.tail = ""
+    self.handle_tokens(self.tokenize(body))
     return self.finish()
 
+  def handle_tokens(self, tokens):
+    for kind, value in tokens:
+      if kind == TAG:
+        self.add_tag(value)
+      else:
+        self.add_text(value)
+
+  def tokenize(self, body, final=True):
+    # 한 글자씩 text += c 로 쌓지 않고, str.find 로 '<' / '>' 위치만 찾아서 슬라이스로 토큰을 만든다.
+    # 주석은 여기서 건너뛰고(앞뒤 텍스트는 하나로 이어진다), 엔티티는 텍스트 토큰에만 풀어준다.
+    # final 이 아니면 아직 끝나지 않은 마지막 토큰은 self.pending 에 남긴다.
+    i = 0
+    end = len(body)
+    close = -1
+    run = []
+
+    while i < end:
+      lt = body.find("<", i)
+      if lt == -1:
+        run.append(body[i:])
+        break
+      if lt > i:
+        run.append(body[i:lt])
+
+      if body.startswith("<!--", lt):
+        comment_end = body.find("-->", lt + 4)
+        if comment_end == -1:
+          if not final:
+            self._keep("".join(run) + body[lt:], "-->")
+          elif run:
+            yield TEXT, decode_entities("".join(run))
+          return
+        i = comment_end + 3
+        continue
+
+      if close < lt:
+        close = body.find(">", lt + 1)
+        if close == -1:
+          if not final:
+            self._keep("".join(run) + body[lt:], ">")
+          elif run:
+            yield TEXT, decode_entities("".join(run))
+          return
+
+      if run:
+        yield TEXT, decode_entities("".join(run))
+        run = []
+
+      # 태그가 닫히기 전에 '<' 가 또 나오면 그 앞까지는 텍스트로 본다.
+      restart = body.find("<", lt + 1, close)
+      if restart != -1:
+        if restart > lt + 1:
+          yield TEXT, decode_entities(body[lt + 1:restart])
+        i = restart
+        continue
+
+      yield TAG, body[lt + 1:close]
+      i = close + 1
+
+    if run:
+      if final:
+        yield TEXT, decode_entities("".join(run))
+      else:
+        self._keep("".join(run), None)
+
+  def _keep(self, rest, waiting_for):
+    self.pending.append(rest)
+    self.tail = rest[-2:]
+    self.waiting_for = waiting_for
+
   def add_text(self, text):
     if text.isspace():
       if not (self.unfinished and self.unfinished[-1].tag == "pre"):
@@ -47,8 +148,8 @@ class HTMLParser:
     self.implicit_tags(None)
 
     parent = self.unfinished[-1]
-    node = Text(text, parent)
-    parent.children.append(node)
+    node = self.new_text(text, parent)
+    parent.append_child(node)
 
   def add_tag(self, tag):
     tag, attributes = self.get_attributes(tag)
@@ -59,38 +160,46 @@ class HTMLParser:
 
     if tag.startswith("/"):
       closing = tag[1:]
-      i = len(self.unfinished) - 1
-      while i > 0 and self.unfinished[i].tag != closing:
-        i -= 1
-      if i == 0:
-        return  
-      while len(self.unfinished) - 1 >= i:
-        node = self.unfinished.pop()
+      count = self.open_counts.get(closing, 0)
+      # 맨 바깥(html) 하나만 열려 있으면 닫지 않는다.
+      if count == 0 or (count == 1 and self.unfinished[0].tag == closing):
+        return
+      while True:
+        node = self.pop()
         parent = self.unfinished[-1]
-        parent.children.append(node)
+        parent.append_child(node)
+        if node.tag == closing:
+          break
     elif tag in SELF_CLOSING_TAGS:
       parent = self.unfinished[-1]
-      node = Element(tag, attributes, parent)
-      parent.children.append(node)
+      node = self.new_element(tag, attributes, parent)
+      parent.append_child(node)
     else:
       parent = self.unfinished[-1] if self.unfinished else None
-      node = Element(tag,attributes,  parent)
-      self.unfinished.append(node)
+      node = self.new_element(tag,attributes,  parent)
+      self.push(node)
+
+  def push(self, node):
+    self.unfinished.append(node)
+    self.open_counts[node.tag] = self.open_counts.get(node.tag, 0) + 1
+
+  def pop(self):
+    node = self.unfinished.pop()
+    self.open_counts[node.tag] -= 1
+    return node
+
+  def is_open(self, tag):
+    return self.open_counts.get(tag, 0) > 0
   
   def get_attributes(self, text):
-    parts = shlex.split(text) if text and text.strip() else []
-    if not parts:
-      return "", {}
-
-    tag = parts[0].casefold()
+    name = TAG_NAME.match(text)
+    tag = name.group(1).casefold()
 
     attributes = {}
-    for attrpair in parts[1:]:
-      if "=" in attrpair:
-        key, value = attrpair.split("=", 1)
-        attributes[key.casefold()] = value
-      else:
-        attributes[attrpair.casefold()] = True
+    if name.end() < len(text):
+      for key, equals, double, single, bare in ATTRIBUTE.findall(text, name.end()):
+        value = double or single or bare
+        attributes[key.casefold()] = decode_entities(value) if equals else True
 
     return tag, attributes
 
@@ -99,31 +208,33 @@ class HTMLParser:
       self.implicit_tags(None)
 
     while len(self.unfinished) > 1:
-      node = self.unfinished.pop()
+      node = self.pop()
       parent = self.unfinished[-1]
-      parent.children.append(node)
+      parent.append_child(node)
       
     if not self.unfinished:
       return None
-    return self.unfinished.pop()
+    return self.pop()
   
   def implicit_tags(self, tag):
+    # 열린 태그 목록을 매번 만들지 않고, 깊이와 open_counts 만 보고 판단한다.
     while True:
-      open_tags = [node.tag for node in self.unfinished]
+      depth = len(self.unfinished)
+      in_head = self.is_open("head") and not self.is_open("body")
 
-      if tag is None and ("head" in open_tags) and ("body" not in open_tags):
+      if tag is None and in_head:
         break
       
-      if open_tags == [] and tag != "html":
+      if depth == 0 and tag != "html":
         self.add_tag("html")
-      elif open_tags == ["html"] and tag not in ["head", "body", "/html"]:
+      elif depth == 1 and self.unfinished[0].tag == "html" and tag not in ["head", "body", "/html"]:
         if tag in HEAD_TAGS:
           self.add_tag("head")
         else:
           self.add_tag("body")
-      elif open_tags == ["html", "head"] and tag == "body":
+      elif depth == 2 and self.unfinished[0].tag == "html" and self.unfinished[1].tag == "head" and tag == "body":
         self.add_tag("/head")
-      elif ("head" in open_tags) and ("body" not in open_tags) and tag not in ["/head"] + HEAD_TAGS:
+      elif in_head and tag != "/head" and tag not in HEAD_TAGS:
         self.add_tag("/head")
       else:
         break
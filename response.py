@@ -0,0 +1,353 @@
+import codecs
+import re
+import threading
+import zlib
+
+STATUS, HEADERS, BODY, CHUNK_SIZE, CHUNK_DATA, TRAILERS, UNTIL_EOF, DONE = range(8)
+
+BUFFER_SIZE = 64 * 1024
+# 압축 해제는 한 번에 이만큼씩만 풀어서 넘긴다. (압축률이 큰 본문도 메모리를 한꺼번에 쓰지 않게)
+INFLATE_SIZE = 256 * 1024
+
+# Content-Type 에 charset 이 없으면 본문 앞부분에서 BOM 이나 <meta charset> 을 찾아본다.
+SNIFF_SIZE = 1024
+# charset 을 알아도 BOM 이 있으면 BOM 을 따른다. (BOM 은 길어야 3 바이트)
+BOM_SIZE = 3
+DEFAULT_CHARSET = "utf-8"
+CHARSET = re.compile(r"""charset\s*=\s*["']?\s*([-\w.:]+)""", re.IGNORECASE)
+META_CHARSET = re.compile(rb"""<meta[^>]*?charset\s*=\s*["']?\s*([-\w.:]+)""", re.IGNORECASE)
+BOMS = (
+  (codecs.BOM_UTF8, "utf-8-sig"),
+  (codecs.BOM_UTF16_LE, "utf-16"),
+  (codecs.BOM_UTF16_BE, "utf-16"),
+)
+# 브라우저들처럼 latin-1 / ascii 라벨은 windows-1252 로 읽는다.
+CHARSET_ALIASES = {
+  "iso-8859-1": "cp1252",
+  "latin1": "cp1252",
+  "latin-1": "cp1252",
+  "us-ascii": "cp1252",
+  "ascii": "cp1252",
+  # 바이트 순서가 없는 라벨은 브라우저들처럼 little-endian 으로 읽는다. (그냥 utf-16 은 BOM 이 없으면 예외를 던진다)
+  "utf-16": "utf-16-le",
+  "utf-32": "utf-32-le",
+}
+
+def lookup_charset(label):
+  if not label:
+    return None
+  label = label.strip().lower()
+  label = CHARSET_ALIASES.get(label, label)
+  try:
+    return codecs.lookup(label).name
+  except LookupError:
+    return None
+
+def bom_charset(head):
+  for bom, charset in BOMS:
+    if head.startswith(bom):
+      return charset
+  return None
+
+def sniff_charset(head) -> str:
+  charset = bom_charset(head)
+  if charset is not None:
+    return charset
+  match = META_CHARSET.search(head)
+  if match:
+    charset = lookup_charset(match.group(1).decode("ascii", "replace"))
+    # 바이트를 이미 ASCII 로 읽어 찾은 meta 이므로 utf-16 이라는 말은 믿지 않는다.
+    if charset and not charset.startswith("utf-16"):
+      return charset
+  return DEFAULT_CHARSET
+
+# 스레드마다 다 쓴 수신 버퍼를 모아두고 다음 응답에 다시 쓴다.
+_LOCAL = threading.local()
+
+def _free_buffers():
+  free = getattr(_LOCAL, "free", None)
+  if free is None:
+    free = _LOCAL.free = []
+  return free
+
+class ResponseParser:
+  # 소켓을 모르는 HTTP/1.x 응답 파서. 받은 바이트를 feed 로 넣으면 상태줄/헤더를 읽고,
+  # 본문(content-length / chunked / 연결 종료까지)은 프레이밍을 벗겨서 on_body 로 넘긴다.
+  # 동기(URL.request)와 asyncio(URL.request_async) 경로가 같이 쓴다.
+  def __init__(self, on_body=None):
+    self.on_body = on_body
+    self.state = STATUS
+    self.line = bytearray()
+    self.remaining = 0
+    self.eof = False
+    # Content-Length 나 마지막 청크에 닿기 전에 연결이 닫혔다.
+    self.truncated = False
+
+    self.version = ""
+    self.status = ""
+    self.reason = ""
+    self.headers = {}
+
+  @property
+  def head_complete(self):
+    return self.state not in (STATUS, HEADERS)
+
+  @property
+  def done(self):
+    return self.state == DONE
+
+  @property
+  def keep_alive(self):
+    connection = self.headers.get("connection", "").lower()
+    if self.eof or "close" in connection:
+      return False
+    if self.version == "HTTP/1.0" and "keep-alive" not in connection:
+      return False
+    return self.done
+
+  def feed(self, data, start=0, end=None) -> int:
+    # data[start:end] 를 처리하고 어디까지 썼는지 돌려준다. 헤더가 끝나는 지점과
+    # 응답이 끝나는 지점에서 멈추므로, 남은 바이트는 호출한 쪽이 다시 넣거나 다음 응답에 쓴다.
+    pos = start
+    end = len(data) if end is None else end
+    view = memoryview(data)
+
+    while pos < end and self.state != DONE:
+      state = self.state
+
+      if state in (BODY, CHUNK_DATA):
+        size = min(self.remaining, end - pos)
+        self._body(view[pos:pos + size])
+        pos += size
+        self.remaining -= size
+        if self.remaining == 0:
+          # 청크 뒤의 CRLF 는 CHUNK_SIZE 에서 빈 줄로 건너뛴다.
+          self.state = DONE if state == BODY else CHUNK_SIZE
+        continue
+
+      if state == UNTIL_EOF:
+        self._body(view[pos:end])
+        pos = end
+        continue
+
+      newline = data.find(b"\n", pos, end)
+      if newline == -1:
+        self.line.extend(view[pos:end])
+        pos = end
+        break
+      self.line.extend(view[pos:newline])
+      pos = newline + 1
+      line = self.line.decode("iso-8859-1").rstrip("\r")
+      self.line.clear()
+
+      self._line(line)
+      if state == HEADERS and self.head_complete:
+        break
+
+    return pos
+
+  def feed_eof(self):
+    # 연결이 닫혔다. 연결 종료로 끝나는 본문이면 여기서 끝이고, 아니면 잘린 응답이다.
+    # (잘린 본문도 받은 데까지는 쓸 수 있지만 캐시에 넣으면 안 된다)
+    self.eof = True
+    if self.state == UNTIL_EOF:
+      self.state = DONE
+    elif self.head_complete and self.state != DONE:
+      self.truncated = True
+
+  def _body(self, chunk):
+    if self.on_body is not None and len(chunk):
+      self.on_body(chunk)
+
+  def _line(self, line):
+    if self.state == STATUS:
+      parts = line.split(" ", 2)
+      self.version = parts[0]
+      self.status = parts[1] if len(parts) > 1 else ""
+      self.reason = parts[2] if len(parts) > 2 else ""
+      self.state = HEADERS
+
+    elif self.state == HEADERS:
+      if line:
+        if ":" in line:
+          h, v = line.split(":", 1)
+          self.headers[h.casefold()] = v.strip()
+        return
+      self._start_body()
+
+    elif self.state == CHUNK_SIZE:
+      line = line.strip()
+      if line == "":
+        return
+      try:
+        size = int(line.split(";", 1)[0], 16)
+      except ValueError:
+        self.state = DONE
+        return
+      if size == 0:
+        self.state = TRAILERS
+      else:
+        self.remaining = size
+        self.state = CHUNK_DATA
+
+    elif self.state == TRAILERS:
+      if line == "":
+        self.state = DONE
+
+  def _start_body(self):
+    transfer_encoding = self.headers.get("transfer-encoding", "").lower()
+    content_length = self.headers.get("content-length")
+
+    if self.status.startswith("1") or self.status in ("204", "304"):
+      self.state = DONE
+    elif "chunked" in transfer_encoding:
+      self.state = CHUNK_SIZE
+    elif content_length is not None:
+      try:
+        self.remaining = int(content_length)
+      except ValueError:
+        self.remaining = 0
+      self.state = BODY if self.remaining > 0 else DONE
+    else:
+      self.state = UNTIL_EOF
+
+class ResponseReader:
+  # 소켓에서 미리 잡아둔 버퍼로 recv_into 해서 파서에 넣는다. 받은 바이트를 bytes 로 새로 만들지 않고,
+  # 파서는 버퍼 위에서 헤더 줄을 찾고 본문은 memoryview 조각으로 넘긴다.
+  # (on_body 가 받은 memoryview 는 다음 recv 때 덮어써지므로 붙잡아 두면 안 된다)
+  def __init__(self, sock):
+    self.sock = sock
+    free = _free_buffers()
+    self.buffer = free.pop() if free else bytearray(BUFFER_SIZE)
+    self.view = memoryview(self.buffer)
+    self.pos = 0
+    self.end = 0
+
+  @property
+  def drained(self):
+    return self.pos == self.end
+
+  def read_head(self, parser):
+    self._pump(parser, lambda: parser.head_complete)
+
+  def read_body(self, parser):
+    self._pump(parser, lambda: parser.done)
+
+  def _pump(self, parser, finished):
+    while not finished():
+      if self.pos == self.end:
+        n = self.sock.recv_into(self.view)
+        if n == 0:
+          parser.feed_eof()
+          return
+        self.pos, self.end = 0, n
+      self.pos = parser.feed(self.buffer, self.pos, self.end)
+
+  def close(self):
+    if self.buffer is not None:
+      # 다른 스레드에서 닫으면 그 스레드의 목록으로 간다.
+      self.view.release()
+      _free_buffers().append(self.buffer)
+      self.buffer = None
+
+class ResponseBody:
+
+  # 프레이밍을 벗긴 본문 바이트를 받아서 압축 해제/디코딩한다.
+  # gzip/deflate 도 받는 대로 풀고 디코딩해서 on_text 로 흘려보낸다. 바이트는 쌓아두지 않는다.
+  def __init__(self, headers, on_text=None):
+    self.on_text = on_text
+    self.parts = []
+    # on_text 로 한 조각이라도 넘겼는지. 넘긴 뒤에는 되돌릴 수 없다.
+    self.streamed = False
+
+    # decoder 를 만들기 전에는 앞부분을 head 에 모아둔다. charset 을 모르면 SNIFF_SIZE 바이트,
+    # 알면 BOM 을 확인할 BOM_SIZE 바이트까지.
+    match = CHARSET.search(headers.get("content-type", ""))
+    self.charset = lookup_charset(match.group(1)) if match else None
+    self.decoder = None
+    self.head = bytearray()
+
+    encoding = headers.get("content-encoding", "").lower()
+    self.encoding = "gzip" if "gzip" in encoding else "deflate" if "deflate" in encoding else None
+    self.inflater = None
+    if self.encoding == "gzip":
+      self.inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif self.encoding == "deflate":
+      self.inflater = zlib.decompressobj()
+    self.inflated = False
+
+  def feed(self, chunk):
+    if self.encoding is None:
+      self._decode(chunk)
+    elif self.inflater is not None:
+      self._inflate(chunk)
+
+  def _inflate(self, chunk):
+    try:
+      data = self.inflater.decompress(chunk, INFLATE_SIZE)
+      while True:
+        if data:
+          self.inflated = True
+          self._decode(data)
+        if self.inflater.unconsumed_tail:
+          data = self.inflater.decompress(self.inflater.unconsumed_tail, INFLATE_SIZE)
+        elif self.encoding == "gzip" and self.inflater.eof and self.inflater.unused_data:
+          # gzip 은 member 여러 개를 이어 붙일 수 있다. 한 member 가 끝나면 남은 바이트로 다음 member 를 푼다.
+          rest = self.inflater.unused_data
+          self.inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+          data = self.inflater.decompress(rest, INFLATE_SIZE)
+        else:
+          break
+    except zlib.error:
+      if self.inflated:
+        # 중간에 깨졌다. 풀린 데까지만 쓴다.
+        self.inflater = None
+      elif self.encoding == "deflate":
+        # zlib 헤더 없이 raw deflate 를 보내는 서버가 있다.
+        self.encoding = "raw-deflate"
+        self.inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        self._inflate(chunk)
+      else:
+        # Content-Encoding 과 달리 압축되지 않은 본문이다.
+        self.encoding = None
+        self.inflater = None
+        self._decode(chunk)
+
+  def close(self) -> str:
+    if self.inflater is not None:
+      try:
+        self._decode(self.inflater.flush())
+      except zlib.error:
+        pass
+      self.inflater = None
+    if self.decoder is None:
+      self._start_decoder()
+    self._emit(self.decoder.decode(b"", final=True))
+    return "".join(self.parts)
+
+  def _start_decoder(self):
+    if self.charset is None:
+      self.charset = sniff_charset(self.head)
+    else:
+      self.charset = bom_charset(self.head) or self.charset
+    self.decoder = codecs.getincrementaldecoder(self.charset)(errors="replace")
+    head, self.head = self.head, None
+    if head:
+      self._emit(self.decoder.decode(head))
+
+  def _decode(self, data):
+    if self.decoder is None:
+      self.head.extend(data)
+      if len(self.head) < (SNIFF_SIZE if self.charset is None else BOM_SIZE):
+        return
+      self._start_decoder()
+      return
+    self._emit(self.decoder.decode(data))
+
+  def _emit(self, text):
+    if not text:
+      return
+    self.parts.append(text)
+    if self.on_text is not None:
+      self.streamed = True
+      self.on_text(text)
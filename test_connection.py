@@ -0,0 +1,36 @@
+import socket
+import unittest
+
+import connection
+
+class CheckinTest(unittest.TestCase):
+  def setUp(self):
+    self.listener = socket.socket()
+    self.listener.bind(("127.0.0.1", 0))
+    self.listener.listen(16)
+    self.port = self.listener.getsockname()[1]
+
+  def tearDown(self):
+    self.listener.close()
+    connection.close_all()
+
+  def borrow(self):
+    sock, key, _ = connection.get_connection("http", "127.0.0.1", self.port, reuse=False)
+    return sock, key
+
+  def test_second_checkin_keeps_other_borrowers_slot(self):
+    first, key = self.borrow()
+    second, _ = self.borrow()
+    connection.close_connection(key, first)
+    connection.close_connection(key, first)
+    connection.release_connection(key, first)
+    self.assertEqual(connection.get_stats()["in_use"], 1)
+    self.assertEqual(connection.get_stats()["idle"], 0)
+
+    connection.release_connection(key, second)
+    connection.release_connection(key, second)
+    self.assertEqual(connection.get_stats()["in_use"], 0)
+    self.assertEqual(connection.get_stats()["idle"], 1)
+
+if __name__ == "__main__":
+  unittest.main()
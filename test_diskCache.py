@@ -0,0 +1,34 @@
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault("BROWSER_CACHE_DIR", tempfile.mkdtemp())
+
+import cache
+import diskCache
+
+class ReadBodyTest(unittest.TestCase):
+  def test_body_is_streamed_in_slices(self):
+    # 여러 바이트 글자가 READ_SLICE 경계에 걸치게 만든다.
+    body = "가나다라마" * (diskCache.READ_SLICE // 5)
+    key = ("http", "example.test", 80, "/stream")
+    diskCache.store(key, {}, "200", 2 ** 40, body)
+
+    chunks = []
+    self.assertEqual(diskCache.read_body(diskCache.load_record(key), chunks.append), body)
+    self.assertGreater(len(chunks), 1)
+    self.assertEqual("".join(chunks), body)
+
+    # 메모리 계층에 없으면 load_from_cache 도 디스크에서 조각조각 넘겨준다.
+    cache.clear_cache()
+    chunks = []
+    self.assertEqual(cache.load_from_cache(key, chunks.append), body)
+    self.assertGreater(len(chunks), 1)
+    self.assertEqual("".join(chunks), body)
+    # 두 번째는 메모리에서 한 번에 준다.
+    chunks = []
+    self.assertEqual(cache.load_from_cache(key, chunks.append), body)
+    self.assertEqual(chunks, [body])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+
+from domArena import DOMArena, ArenaParser
+from htmlParser import HTMLParser
+from test_htmlParser import PAGE, dump
+
+FIELDS = (
+  "tag_names", "tag_ids", "parents", "first_children", "last_children", "next_siblings",
+  "text_starts", "text_ends", "text_buffer", "attribute_map",
+)
+
+class ArenaParserTest(unittest.TestCase):
+  def assertSameArena(self, arena, expected):
+    for field in FIELDS:
+      self.assertEqual(getattr(arena, field), getattr(expected, field), field)
+
+  def test_matches_arena_built_from_tree(self):
+    page = PAGE + "<pre>  a\n b</pre><script>x < y</script><ul><li>1<li>2</ul>"
+    expected = DOMArena.from_tree(HTMLParser(page).parse())
+    for size in (1, 7, len(page)):
+      parser = ArenaParser()
+      for i in range(0, len(page), size):
+        parser.feed(page[i:i + size])
+      root = parser.close()
+      self.assertSameArena(parser.arena, expected)
+      self.assertEqual(dump(root), dump(HTMLParser(page).parse()))
+
+  def test_empty_document(self):
+    parser = ArenaParser("")
+    self.assertEqual(dump(parser.parse()), ("html", {}, [("body", {}, [])]))
+
+if __name__ == "__main__":
+  unittest.main()
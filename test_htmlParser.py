@@ -0,0 +1,79 @@
+import unittest
+
+from htmlParser import HTMLParser
+
+def dump(node):
+  # 비교하기 쉽게 트리를 중첩 튜플로 바꾼다.
+  if hasattr(node, "text"):
+    return node.text
+  return (node.tag, dict(node.attributes), [dump(child) for child in node.children])
+
+def parse(*chunks):
+  parser = HTMLParser()
+  for chunk in chunks:
+    parser.feed(chunk)
+  return dump(parser.close())
+
+def body(*children):
+  return ("html", {}, [("body", {}, list(children))])
+
+PAGE = (
+  "<!doctype html><html><head><title>t</title></head><body>\n"
+  "<div class=\"item\" data-id='7' hidden><p>Lorem <b>ipsum</b> &amp; dolor</p>"
+  "<!-- a comment with <tags> inside --><br/><img src=x.png></div>\n"
+  "</body></html>"
+)
+
+class TokenizeTest(unittest.TestCase):
+  def test_every_split_point_gives_the_same_tree(self):
+    whole = dump(HTMLParser(PAGE).parse())
+    for i in range(len(PAGE) + 1):
+      self.assertEqual(parse(PAGE[:i], PAGE[i:]), whole, i)
+
+  def test_chunk_boundary_inside_tag(self):
+    expected = body(("div", {"class": "a"}, ["x"]))
+    self.assertEqual(parse("<di", "v class=\"a\">x</div>"), expected)
+    self.assertEqual(parse("<div cl", "ass=\"", "a\"", ">x<", "/div>"), expected)
+
+  def test_unterminated_tag_at_close(self):
+    self.assertEqual(parse("a<div class"), body("a"))
+    self.assertEqual(parse("a", "<div class=\"x"), body("a"))
+
+  def test_self_closing_slash(self):
+    self.assertEqual(parse("a<br/>b"), body("a", ("br", {}, []), "b"))
+    self.assertEqual(parse("<img src=x.png/>"), body(("img", {"src": "x.png/"}, [])))
+
+  def test_unbalanced_attribute_quotes(self):
+    # 닫히지 않은 따옴표는 태그 끝('>')까지를 값으로 본다. 따옴표 안의 '>' 도 태그를 닫는다.
+    self.assertEqual(parse("<a href=\"x>y</a>"), body(("a", {"href": "x"}, ["y"])))
+    self.assertEqual(parse("<a href='x\" title=y>z</a>"), body(("a", {"href": "x\" title=y"}, ["z"])))
+    self.assertEqual(parse("<p title=\"a>b\">c</p>"), body(("p", {"title": "a"}, ["b\">c"])))
+
+class CommentEntityTest(unittest.TestCase):
+  def test_comment_is_skipped_and_text_joined(self):
+    self.assertEqual(parse("a<!-- x <b>not a tag</b> -->b"), body("ab"))
+    self.assertEqual(parse("a<!---->b<!-- -- -->c"), body("abc"))
+
+  def test_comment_end_split_across_chunks(self):
+    for chunks in (("a<!-- x --", ">b"), ("a<!-- x -", "-", ">b"), ("a<!", "-- x -->b"), ("a<!-- x ->", "-->b")):
+      self.assertEqual(parse(*chunks), body("ab"), chunks)
+
+  def test_unterminated_comment_at_close(self):
+    self.assertEqual(parse("a<!-- never closed <b>x</b>"), body("a"))
+    self.assertEqual(parse("a", "<!-- never", " closed"), body("a"))
+
+  def test_entities_in_text_and_attributes(self):
+    self.assertEqual(parse("x &amp; y &copy;&#65;&#x42;"), body("x & y ©AB"))
+    self.assertEqual(parse("<a title=\"&quot;q&quot;\" href=/a?b=1&amp;c=2>z</a>"),
+                     body(("a", {"title": "\"q\"", "href": "/a?b=1&c=2"}, ["z"])))
+
+  def test_entity_split_across_chunks(self):
+    self.assertEqual(parse("x &am", "p; y<b>z</b>"), body("x & y", ("b", {}, ["z"])))
+    self.assertEqual(parse("x &", "lt", "; y"), body("x < y"))
+
+  def test_escaped_tag_stays_text(self):
+    self.assertEqual(parse("&lt;b&gt;bold&lt;/b&gt;"), body("<b>bold</b>"))
+    self.assertEqual(parse("&lt;!-- x --&gt;"), body("<!-- x -->"))
+
+if __name__ == "__main__":
+  unittest.main()
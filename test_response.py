@@ -0,0 +1,43 @@
+import codecs
+import gzip
+import unittest
+
+from response import ResponseBody
+
+def decode(headers, body, chunk_size=1):
+  # 소켓에서 받듯 본문을 잘게 나눠 넣는다.
+  chunks = []
+  response = ResponseBody(headers, chunks.append)
+  for i in range(0, len(body), chunk_size):
+    response.feed(body[i:i + chunk_size])
+  text = response.close()
+  assert "".join(chunks) == text
+  return text
+
+class CharsetTest(unittest.TestCase):
+  def test_utf16_without_bom_is_little_endian(self):
+    for label, codec in (("utf-16", "utf-16-le"), ("UTF-32", "utf-32-le")):
+      headers = {"content-type": "text/html; charset=" + label}
+      self.assertEqual(decode(headers, "héllo".encode(codec)), "héllo")
+
+  def test_bom_wins_over_content_type(self):
+    headers = {"content-type": "text/html; charset=utf-16"}
+    self.assertEqual(decode(headers, codecs.BOM_UTF16_BE + "héllo".encode("utf-16-be")), "héllo")
+    headers = {"content-type": "text/html; charset=cp1252"}
+    self.assertEqual(decode(headers, codecs.BOM_UTF8 + "héllo".encode("utf-8")), "héllo")
+
+  def test_short_body_with_charset(self):
+    headers = {"content-type": "text/plain; charset=utf-8"}
+    self.assertEqual(decode(headers, b"ok"), "ok")
+    self.assertEqual(decode(headers, b""), "")
+
+class InflateTest(unittest.TestCase):
+  def test_gzip_members_are_concatenated(self):
+    headers = {"content-encoding": "gzip"}
+    body = gzip.compress(b"hello ") + gzip.compress(b"world") + gzip.compress(b"!" * 100_000)
+    expected = "hello world" + "!" * 100_000
+    for chunk_size in (1, 7, len(body)):
+      self.assertEqual(decode(headers, body, chunk_size), expected)
+
+if __name__ == "__main__":
+  unittest.main()
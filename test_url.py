@@ -0,0 +1,136 @@
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+os.environ.setdefault("BROWSER_CACHE_DIR", tempfile.mkdtemp())
+
+import connection
+from url import URL
+
+BODY = b"hello"
+
+def serve(listener):
+  # keep-alive 로 같은 응답을 계속 돌려주는 로컬 서버
+  def handle(conn):
+    with conn:
+      try:
+        while conn.recv(65536):
+          conn.sendall(b"HTTP/1.1 200 OK\r\nCache-Control: no-store\r\nContent-Type: text/html; charset=utf-8\r\nContent-Length: %d\r\n\r\n" % len(BODY) + BODY)
+      except OSError:
+        pass
+
+  def run():
+    while True:
+      try:
+        conn, _ = listener.accept()
+      except OSError:
+        return
+      threading.Thread(target=handle, args=(conn,), daemon=True).start()
+
+  threading.Thread(target=run, daemon=True).start()
+
+class FetchTest(unittest.TestCase):
+  def setUp(self):
+    self.listener = socket.socket()
+    self.listener.bind(("127.0.0.1", 0))
+    self.listener.listen(16)
+    serve(self.listener)
+    self.url = "http://127.0.0.1:%d/" % self.listener.getsockname()[1]
+
+  def tearDown(self):
+    self.listener.close()
+    connection.close_all()
+
+  def test_raising_on_text_returns_connection(self):
+    def on_text(text):
+      raise RuntimeError("callback failed")
+
+    def run():
+      for _ in range(connection.MAX_ACTIVE_PER_HOST + 1):
+        with self.assertRaises(RuntimeError):
+          URL(self.url).request(on_text=on_text)
+      result.append(URL(self.url).request())
+
+    # 자리가 새면 get_connection 이 영원히 기다리므로 스레드에서 돌리고 시간을 잰다.
+    result = []
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(5)
+    self.assertFalse(thread.is_alive(), "request blocked waiting for a leaked connection")
+    self.assertEqual(result, ["hello"])
+    self.assertEqual(connection.get_stats()["in_use"], 0)
+
+class TruncatedBodyTest(unittest.TestCase):
+  # 첫 응답은 Content-Length 보다 짧게 보내고 끊는다. 그다음부터는 제대로 보낸다.
+  def setUp(self):
+    self.hits = 0
+    self.listener = socket.socket()
+    self.listener.bind(("127.0.0.1", 0))
+    self.listener.listen(16)
+    threading.Thread(target=self.serve, daemon=True).start()
+    self.url = "http://127.0.0.1:%d/" % self.listener.getsockname()[1]
+
+  def serve(self):
+    while True:
+      try:
+        conn, _ = self.listener.accept()
+      except OSError:
+        return
+      with conn:
+        conn.recv(65536)
+        self.hits += 1
+        head = b"HTTP/1.1 200 OK\r\nCache-Control: max-age=60\r\nConnection: close\r\nContent-Length: 11\r\n\r\n"
+        conn.sendall(head + (b"hello" if self.hits == 1 else b"hello world"))
+
+  def tearDown(self):
+    self.listener.close()
+    connection.close_all()
+
+  def test_truncated_body_is_retried(self):
+    self.assertEqual(URL(self.url + "retry").request(), "hello world")
+    self.assertEqual(self.hits, 2)
+    # 두 번째(완전한) 응답은 캐시된다.
+    self.assertEqual(URL(self.url + "retry").request(), "hello world")
+    self.assertEqual(self.hits, 2)
+
+  def test_truncated_body_is_not_cached(self):
+    # on_text 로 이미 넘긴 본문은 되돌릴 수 없으니 다시 받지 않고 받은 데까지만 돌려준다.
+    chunks = []
+    self.assertEqual(URL(self.url + "partial").request(on_text=chunks.append), "hello")
+    self.assertEqual("".join(chunks), "hello")
+    self.assertEqual(URL(self.url + "partial").request(), "hello world")
+    self.assertEqual(self.hits, 2)
+
+class ResetMidBodyTest(unittest.TestCase):
+  # 본문 앞부분만 보내고 RST 로 연결을 끊는다.
+  def setUp(self):
+    self.listener = socket.socket()
+    self.listener.bind(("127.0.0.1", 0))
+    self.listener.listen(1)
+    threading.Thread(target=self.serve, daemon=True).start()
+    self.url = "http://127.0.0.1:%d/" % self.listener.getsockname()[1]
+
+  def serve(self):
+    conn, _ = self.listener.accept()
+    conn.recv(65536)
+    conn.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: text/html; charset=utf-8\r\nContent-Length: 1000\r\n\r\nhello")
+    time.sleep(0.2)
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+    conn.close()
+
+  def tearDown(self):
+    self.listener.close()
+    connection.close_all()
+
+  def test_error_is_not_appended_to_streamed_text(self):
+    chunks = []
+    text = URL(self.url).request(on_text=chunks.append)
+    self.assertEqual(chunks, ["hello"])
+    self.assertEqual(text, "hello")
+
+if __name__ == "__main__":
+  unittest.main()
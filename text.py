@@ -1,8 +1,19 @@
+from element import mark_dirty
+
 class Text:
+  __slots__ = ("text", "parent", "layout_object")
+
+  # Text 는 자식을 가질 수 없으므로 노드마다 빈 list 를 만들지 않는다.
+  children = ()
+
   def __init__(self, text, parent):
     self.text = text
-    self.children = []
     self.parent = parent
+    self.layout_object = None
+
+  def set_text(self, text):
+    self.text = text
+    mark_dirty(self)
 
   def __repr__(self):
     return repr(self.text)
@@ -1,22 +1,23 @@
-import gzip
-import html as _html
-import re
+import asyncio
+import ssl
+import threading
 import urllib.parse
+from concurrent.futures import Future
 
-from cache import get_cache_key, load_from_cache, store_in_cache
-from connection import get_connection, close_connection
+from cache import (
+  get_cache_key, load_from_cache, store_in_cache,
+  get_cache_entry, validator_headers, update_from_304, stale_body,
+)
+from connection import get_connection, release_connection, close_connection
+from response import ResponseParser, ResponseReader, ResponseBody
 
-DEFAULT_LOCAL_FILE = "file:///Users/jinokseong/Documents/진옥/스터디/browser/default.html"
-
-def remove_html_comments(text: str) -> str:
-  return re.sub(r"<!--.*?-->", "", text, flags=re.DOTALL)
+READ_SIZE = 64 * 1024
 
-def decode_html_entities(text: str) -> str:
-  return _html.unescape(text)
+# 지금 받고 있는 요청: cache key -> (결과를 받을 Future, 받고 있는 스레드)
+_IN_FLIGHT = {}
+_IN_FLIGHT_LOCK = threading.Lock()
 
-def lex(body: str) -> str:
-  body = remove_html_comments(body)
-  return decode_html_entities(body)
+DEFAULT_LOCAL_FILE = "file:///Users/jinokseong/Documents/진옥/스터디/browser/default.html"
 
 class URL:
   def __init__(self, url: str):
@@ -37,7 +38,7 @@ class URL:
 
     self.connection = "keep-alive"
     self.user_agent = "KAKAOPAY/25.9.0"
-    self.accept_encoding = "gzip"
+    self.accept_encoding = "gzip, deflate"
 
     if self.scheme == "view-source":
       self.inner_url = rest
@@ -71,138 +72,248 @@ class URL:
       self.port = int(port)
     self.host = hostpart
 
-  def _read_chunked_body(self, response) -> bytes:
-    body = bytearray()
-    while True:
-      line = response.readline().decode("iso-8859-1")
-      if not line:
-        break
+  def _deliver(self, text: str, on_text=None) -> str:
+    if on_text is not None:
+      on_text(text)
+    return text
 
-      line = line.strip()
-      if line == "":
-        continue
+  # 아래 헬퍼들은 동기(request)와 asyncio(request_async) 경로가 같이 쓴다.
 
-      size_str = line.split(";", 1)[0]
-      try:
-        chunk_size = int(size_str, 16)
-      except ValueError:
-        break
-
-      if chunk_size == 0:
-        while True:
-          trailer = response.readline().decode("iso-8859-1")
-          if trailer in ("\r\n", ""):
-            break
-        break
-
-      chunk = response.read(chunk_size)
-      if not chunk:
-        break
-      body.extend(chunk)
-
-      _ = response.read(2)  
-    return bytes(body)
-
-  def request(self, redirect_count=0, max_redirects=10) -> str:
+  def _local_body(self, redirect_count, max_redirects, on_text):
+    # 네트워크 없이 답할 수 있으면 본문(또는 에러 문자열)을 on_text 로 넘기고 돌려준다. 아니면 None.
     if redirect_count > max_redirects:
-      return f"[Redirect error] Exceeded {max_redirects} redirects"
-
-    if self.scheme == "view-source":
-      inner = URL(self.inner_url)
-      return inner.request(redirect_count=redirect_count + 1, max_redirects=max_redirects)
+      return self._deliver(f"[Redirect error] Exceeded {max_redirects} redirects", on_text)
 
     if self.scheme == "data":
-      return self.data_body
+      return self._deliver(self.data_body, on_text)
 
     if self.scheme == "file":
       try:
         with open(self.path, "r", encoding="utf-8") as f:
-          return f.read()
+          return self._deliver(f.read(), on_text)
       except FileNotFoundError:
-        return f"[File error] File not found: {self.path}"
+        return self._deliver(f"[File error] File not found: {self.path}", on_text)
       except OSError as e:
-        return f"[File error] {e}"
-
-    cache_key = get_cache_key(self.scheme, self.host, self.port, self.path)
-    cached = load_from_cache(cache_key)
-    if cached is not None:
-      return cached
+        return self._deliver(f"[File error] {e}", on_text)
+
+    # 디스크 캐시의 본문은 읽는 대로 조각조각 on_text 로 넘어간다.
+    return load_from_cache(self._cache_key(), on_text)
+
+  def _cache_key(self):
+    return get_cache_key(self.scheme, self.host, self.port, self.path)
+
+  def _request_bytes(self, entry=None) -> bytes:
+    # entry 는 신선하지 않은 캐시 항목. 있으면 조건부 요청으로 보낸다.
+    req = f"GET {self.path} HTTP/1.1\r\n"
+    req += f"Host: {self.host}\r\n"
+    req += f"Connection: {self.connection}\r\n"
+    req += f"User-Agent: {self.user_agent}\r\n"
+    req += f"Accept-Encoding: {self.accept_encoding}\r\n"
+    for name, value in validator_headers(entry).items():
+      req += f"{name}: {value}\r\n"
+    req += "\r\n"
+    return req.encode("utf-8")
+
+  def _redirect_target(self, parser):
+    # 3xx 이면 따라갈 URL 을, 따라갈 수 없으면 에러 문자열을, 리다이렉트가 아니면 None 을 돌려준다.
+    if not parser.status.startswith("3") or parser.status == "304":
+      return None
+
+    location = parser.headers.get("location")
+    if not location:
+      return f"[HTTP redirect {parser.status}] (no Location header)"
+
+    if location.startswith("/"):
+      port = "" if (self.scheme, self.port) in [("http", 80), ("https", 443)] else f":{self.port}"
+      location = f"{self.scheme}://{self.host}{port}{location}"
+    return URL(location)
+
+
+  def _finish_body(self, parser, body, entry=None) -> str:
+    text = body.close()
+    if parser.status == "304" and entry is not None:
+      # 조건부 요청에 304 가 왔다. 갖고 있던 본문을 그대로 쓴다.
+      return self._deliver(update_from_304(self._cache_key(), entry, parser.headers), body.on_text)
+    if not parser.truncated:
+      store_in_cache(self._cache_key(), parser.headers, text, parser.status)
+    return text
+
+  def _network_error(self, error, entry, on_text, body=None) -> str:
+    if body is not None and body.streamed:
+      # 본문 일부를 이미 on_text 로 넘겼다. 에러 문자열이나 캐시 본문을 덧붙이지 않고 받은 데까지만 돌려준다.
+      return body.close()
+    # 서버에 닿지 못했으면, 허락된 경우 오래된 캐시 본문이라도 보여준다.
+    stale = stale_body(entry)
+    if stale is not None:
+      return self._deliver(stale, on_text)
+    return self._deliver(f"[Network error] {error}", on_text)
+
+  def request(self, redirect_count=0, max_redirects=10, on_text=None) -> str:
+    # on_text 를 주면 본문을 받는 대로 디코딩해서 조각 단위로 넘겨준다. (반환값은 그대로 전체 본문)
+    if self.scheme == "view-source" and redirect_count <= max_redirects:
+      inner = URL(self.inner_url)
+      return inner.request(redirect_count=redirect_count + 1, max_redirects=max_redirects, on_text=on_text)
+
+    local = self._local_body(redirect_count, max_redirects, on_text)
+    if local is not None:
+      return local
+
+    if redirect_count > 0:
+      # 리다이렉트 중간 단계는 합치지 않는다. (서로의 리다이렉트를 기다리다 멈추는 일이 없도록)
+      return self._fetch(redirect_count, max_redirects, on_text)
+
+    key = self._cache_key()
+    me = threading.get_ident()
+    with _IN_FLIGHT_LOCK:
+      flight = _IN_FLIGHT.get(key)
+      leader = flight is None
+      if leader:
+        flight = _IN_FLIGHT[key] = (Future(), me)
+    future, owner = flight
+    if not leader:
+      if owner == me:
+        # 받는 도중(on_text 안에서) 같은 URL 을 다시 부르면 기다릴 수 없다.
+        return self._fetch(redirect_count, max_redirects, on_text)
+      # 같은 URL 을 다른 스레드가 이미 받고 있다. 새로 보내지 않고 그 결과를 같이 쓴다.
+      return self._deliver(future.result(), on_text)
 
-    key = None
     try:
-      s, key = get_connection(self.scheme, self.host, self.port)
-
-      req = f"GET {self.path} HTTP/1.1\r\n"
-      req += f"Host: {self.host}\r\n"
-      req += f"Connection: {self.connection}\r\n"
-      req += f"User-Agent: {self.user_agent}\r\n"
-      req += f"Accept-Encoding: {self.accept_encoding}\r\n"
-      req += "\r\n"
-      s.send(req.encode("utf-8"))
-
-      response = s.makefile("rb")
-      statusline = response.readline().decode("iso-8859-1")
-      if not statusline:
-        close_connection(key)
-        return "[Network error] Empty status line"
-
-      _version, status, _explanation = statusline.split(" ", 2)
-
-      headers = {}
-      while True:
-        line = response.readline().decode("iso-8859-1")
-        if line == "\r\n":
+      text = self._fetch(redirect_count, max_redirects, on_text)
+    except BaseException as e:
+      future.set_exception(e)
+      raise
+    else:
+      future.set_result(text)
+      return text
+    finally:
+      with _IN_FLIGHT_LOCK:
+        del _IN_FLIGHT[key]
+
+  def _fetch(self, redirect_count, max_redirects, on_text, retried=False) -> str:
+    entry = get_cache_entry(self._cache_key())
+    req = self._request_bytes(entry)
+    # s 가 None 이 아니면 아직 이 요청이 빌린 소켓이다. 어떤 예외로 빠져나가든 finally 에서 돌려준다.
+    # (on_text 나 파서가 도중에 예외를 던져도 호스트당 자리가 새지 않게)
+    s = key = reader = body = None
+    try:
+      for attempt in range(2):
+        s, key, reused = get_connection(self.scheme, self.host, self.port, reuse=(attempt == 0))
+        parser = ResponseParser()
+        reader = ResponseReader(s)
+        try:
+          s.sendall(req)
+          reader.read_head(parser)
+        except OSError:
+          if not reused:
+            raise
+        if parser.head_complete or not reused:
           break
-        h, v = line.split(":", 1)
-        headers[h.casefold()] = v.strip()
+        # 재사용한 keep-alive 소켓을 서버가 이미 닫았다. 새 연결로 한 번만 다시 보낸다.
+        reader.close()
+        close_connection(key, s)
+        s = key = None
+
+      if not parser.head_complete:
+        return self._network_error("Empty status line", entry, on_text)
+
+      target = self._redirect_target(parser)
+      if target is not None:
+        reader.close()
+        close_connection(key, s)
+        s = key = None
+        if isinstance(target, str):
+          return self._deliver(target, on_text)
+        return target.request(
+          redirect_count=redirect_count + 1,
+          max_redirects=max_redirects,
+          on_text=on_text,
+        )
 
-      if status.startswith("3"):
-        location = headers.get("location")
-        response.close()
-        if key is not None:
-          close_connection(key)
+      body = ResponseBody(parser.headers, on_text)
+      parser.on_body = body.feed
+      reader.read_body(parser)
 
-        if not location:
-          return f"[HTTP redirect {status}] (no Location header)"
+      if parser.keep_alive and reader.drained:
+        release_connection(key, s)
+      else:
+        close_connection(key, s)
+      s = key = None
+
+      if parser.truncated and on_text is None and not retried:
+        # 본문이 중간에 끊겼다. 아직 아무 데도 넘기지 않았으니 한 번만 다시 받는다.
+        return self._fetch(redirect_count, max_redirects, on_text, retried=True)
+      return self._finish_body(parser, body, entry)
+
+    except OSError as e:
+      return self._network_error(e, entry, on_text, body)
+    finally:
+      if s is not None:
+        close_connection(key, s)
+      if reader is not None:
+        reader.close()
+
+  async def request_async(self, redirect_count=0, max_redirects=10, on_text=None) -> str:
+    # request() 의 asyncio 버전. 한 스레드에서 여러 요청을 동시에 기다릴 수 있다.
+    # 파싱/리다이렉트/gzip/캐시는 request() 와 같은 헬퍼를 쓰고, 소켓 대신 asyncio 스트림을 쓴다.
+    if self.scheme == "view-source" and redirect_count <= max_redirects:
+      inner = URL(self.inner_url)
+      return await inner.request_async(redirect_count=redirect_count + 1, max_redirects=max_redirects, on_text=on_text)
+
+    local = self._local_body(redirect_count, max_redirects, on_text)
+    if local is not None:
+      return local
 
-        if location.startswith("/"):
-          location = f"{self.scheme}://{self.host}{location}"
+    entry = get_cache_entry(self._cache_key())
+    writer = body = None
+    try:
+      if self.scheme == "https":
+        reader, writer = await asyncio.open_connection(
+          self.host, self.port, ssl=ssl.create_default_context(), server_hostname=self.host)
+      else:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
 
-        return URL(location).request(
+      writer.write(self._request_bytes(entry))
+      await writer.drain()
+
+      parser = ResponseParser()
+      rest = b""
+      while not parser.head_complete:
+        data = await reader.read(READ_SIZE)
+        if not data:
+          parser.feed_eof()
+          break
+        pos = parser.feed(data)
+        rest = data[pos:]
+
+      if not parser.head_complete:
+        return self._network_error("Empty status line", entry, on_text)
+
+      target = self._redirect_target(parser)
+      if target is not None:
+        if isinstance(target, str):
+          return self._deliver(target, on_text)
+        writer.close()
+        writer = None
+        return await target.request_async(
           redirect_count=redirect_count + 1,
           max_redirects=max_redirects,
+          on_text=on_text,
         )
 
-      transfer_encoding = headers.get("transfer-encoding", "").lower()
-      content_length = headers.get("content-length")
-      connection_hdr = headers.get("connection", "").lower()
-
-      if "chunked" in transfer_encoding:
-        body_bytes = self._read_chunked_body(response)
-      else:
-        if content_length is not None:
-          body_bytes = response.read(int(content_length))
-        else:
-          body_bytes = response.read()
-          if key is not None:
-            close_connection(key)
-
-      response.close()
-      if "close" in connection_hdr and key is not None:
-        close_connection(key)
-
-      content_encoding = headers.get("content-encoding", "").lower()
-      if "gzip" in content_encoding:
-        try:
-          body_bytes = gzip.decompress(body_bytes)
-        except OSError:
-          pass
+      body = ResponseBody(parser.headers, on_text)
+      parser.on_body = body.feed
+      parser.feed(rest)
+      while not parser.done:
+        data = await reader.read(READ_SIZE)
+        if not data:
+          parser.feed_eof()
+          break
+        parser.feed(data)
 
-      body = body_bytes.decode("utf-8", errors="replace")
-      store_in_cache(cache_key, headers, body)
-      return body
+      return self._finish_body(parser, body, entry)
 
     except OSError as e:
-      if key is not None:
-        close_connection(key)
-      return f"[Network error] {e}"
+      return self._network_error(e, entry, on_text, body)
+    finally:
+      if writer is not None:
+        writer.close()